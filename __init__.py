@@ -32,9 +32,14 @@ bl_info = {
 
 if "bpy" in locals():
     import imp
+    imp.reload(functions)
+    imp.reload(strip_index)
     imp.reload(jumptocut)
     imp.reload(operators_extra_actions)
     imp.reload(audio_tools)
+    imp.reload(metadata)
+    imp.reload(proxy_jobs)
+    imp.reload(proxy_cache)
     imp.reload(proxy_tools)
     imp.reload(recursive_loader)
     imp.reload(eco)
@@ -42,9 +47,14 @@ if "bpy" in locals():
     imp.reload(ui)
     imp.reload(datamosh)
 else:
+    from . import functions
+    from . import strip_index
     from . import jumptocut
     from . import operators_extra_actions
     from . import audio_tools
+    from . import metadata
+    from . import proxy_jobs
+    from . import proxy_cache
     from . import proxy_tools
     from . import recursive_loader
     from . import eco
@@ -124,14 +134,93 @@ class KinorawToolsAddon(bpy.types.AddonPreferences):
         name = 'directory to store proxy scripts',
         default = "//proxy_scripts/")
     proxy_scripts = BoolProperty(
-        name = 'generate ffmpeg scritps',
+        name = 'write jobs for proxy_runner.py',
         default = False)
     ffmpeg_command = StringProperty(
         name = 'command to generate proxy',
         default = '''ffmpeg -i {} -vcodec mjpeg -q:v 10 -s {}x{} -an -y {}''')
+    use_proxy_cache = BoolProperty(
+        name = 'shared proxy cache',
+        description = 'store ffmpeg proxies in a cache shared by every '
+            'blend file, indexed by source content instead of file name',
+        default = False)
+    proxy_cache_dir = StringProperty(
+        name = 'proxy cache directory',
+        description = 'empty to use the user cache directory',
+        default = '')
+    proxy_cache_size = IntProperty(
+        name = 'proxy cache size',
+        description = 'maximum size of the proxy cache in GB, least '
+            'recently used proxies are removed when it is full',
+        default = 50,
+        min = 1, max = 100000)
+    proxy_single_decode = BoolProperty(
+        name = 'decode once for all sizes',
+        description = 'build every checked proxy size with a single ffmpeg '
+            'process that decodes the source only once',
+        default = True)
+    ffmpeg_output_args = StringProperty(
+        name = 'ffmpeg output arguments for single decode proxies',
+        default = '''-vcodec mjpeg -q:v 10 -an''')
+    proxy_max_jobs = IntProperty(
+        name = 'simultaneous proxy jobs',
+        description = 'number of ffmpeg processes running at the same time, '
+            '0 = number of cores / threads per job',
+        default = 0,
+        min = 0, max = 256)
+    proxy_job_threads = IntProperty(
+        name = 'threads per proxy job',
+        description = 'cpu threads every ffmpeg process is expected to use',
+        default = 2,
+        min = 1, max = 64)
+    proxy_segments = IntProperty(
+        name = 'proxy segments',
+        description = 'split long sources at keyframes and encode the '
+            'segments in parallel, 0 = do not split',
+        default = 0,
+        min = 0, max = 256)
+    proxy_segment_min_length = IntProperty(
+        name = 'minimum length to split',
+        description = 'only split sources longer than this, in seconds',
+        default = 300,
+        min = 1)
+    proxy_used_range = BoolProperty(
+        name = 'used range only',
+        description = 'encode only the frames used by the strips of the '
+            'source, plus handles, other frames are black',
+        default = False)
+    proxy_handles = IntProperty(
+        name = 'proxy handles',
+        description = 'frames encoded before and after the used range',
+        default = 25,
+        min = 0)
+    proxy_log_file = StringProperty(
+        name = 'proxy log file',
+        description = 'append the stats of every proxy job to this '
+            'json lines file, empty = no log',
+        default = '')
+    proxy_build_25 = BoolProperty(
+        name = 'build 25% proxy',
+        default = True)
+    proxy_build_50 = BoolProperty(
+        name = 'build 50% proxy',
+        default = False)
+    proxy_build_75 = BoolProperty(
+        name = 'build 75% proxy',
+        default = False)
+    proxy_build_100 = BoolProperty(
+        name = 'build 100% proxy',
+        default = False)
     use_internal_proxy = BoolProperty(
         name = 'use internal blender proxy system',
         default = True)
+    bi_proxy_workers = IntProperty(
+        name = 'blender proxy workers',
+        description = 'build blender internal proxies and timecode indices '
+            'in this number of background blender processes, '
+            '0 = only set up the strips',
+        default = 0,
+        min = 0, max = 64)
     use_bi_custom_directory = BoolProperty(
         name = 'Proxy Custom Directory',
         default = True)
@@ -159,7 +248,7 @@ class KinorawToolsAddon(bpy.types.AddonPreferences):
         name='path to store audio scripts',
         default="//audio_scripts/")
     audio_scripts = BoolProperty(
-        name='generate ffmpeg scritps',
+        name='write jobs for proxy_runner.py',
         default=False)
 
     #  Audio Tools - external links
@@ -239,7 +328,9 @@ class KinorawToolsAddon(bpy.types.AddonPreferences):
 def register():
     bpy.utils.register_class(KinorawToolsAddon)
 
+    functions.register_scene_properties()
     bpy.utils.register_module(__name__)
+    jumptocut.register_handlers()
  
     # Append menu entries
     bpy.types.SEQUENCER_MT_add.prepend(ui.sequencer_add_menu_func)
@@ -291,7 +382,20 @@ def register():
 
 
 def unregister():
+    jumptocut.unregister_handlers()
     bpy.utils.unregister_module(__name__)
+    functions.unregister_scene_properties()
+
+    # stop the exiftool processes started by the addon
+    for handlers, handler in recursive_loader.exif_handlers:
+        if handler in handlers:
+            handlers.remove(handler)
+    metadata.shutdown()
+
+    # stop the proxy jobs, nothing would poll them anymore
+    proxy_tools.stop_proxy_jobs()
+    if proxy_tools.proxy_jobs_load_handler in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(proxy_tools.proxy_jobs_load_handler)
 
 
     try:
@@ -1,15 +1,18 @@
 import bpy, os
 from bpy.props import IntProperty, StringProperty, BoolProperty
 import subprocess
+import shlex
 
 from . import functions
+from . import proxy_jobs
 
 
 proxy_qualities = [  ( "1", "25%", "" ), ( "2", "50%", "" ),
                     ( "3", "75%", "" ), ( "4", "100%", "" )]
                     
 #
-#  ls *.sh | parallel -j 8 sh {}
+#  with audio scripts on, extractions are added to jobs.json, run them with
+#  python3 proxy_runner.py audio_scripts/jobs.json -j 8
 #
 
 # functions
@@ -80,10 +83,12 @@ class ExtractWavOperator(bpy.types.Operator):
     def execute(self, context):
 
         preferences = context.user_preferences
-        audio_dir = preferences.addons[__package__].preferences.audio_dir
+        prefs = preferences.addons[__package__].preferences
+        audio_dir = prefs.audio_dir
 
         functions.create_folder(bpy.path.abspath(audio_dir))
 
+        jobs = []
         for strip in context.selected_editable_sequences:
 
             # get filename
@@ -97,9 +102,14 @@ class ExtractWavOperator(bpy.types.Operator):
             # check for wav existing file
             if not os.path.isfile(fileoutput):
                 #if not, extract the file
-                extract_audio = "ffmpeg -i '{}' -acodec pcm_s16le -ac 2 {}".\
-                format(filename, fileoutput)
+                extract_audio = "ffmpeg -i {} -acodec pcm_s16le -ac 2 {}".\
+                format(shlex.quote(filename), shlex.quote(fileoutput))
                 print(extract_audio)
+                if prefs.audio_scripts:
+                    jobs.append(proxy_jobs.ProxyJob(extract_audio,
+                        [fileoutput], strip_names=[strip.name],
+                        source=filename, kind="audio"))
+                    continue
                 os.system(extract_audio)
             else:
                 print("ya existe")
@@ -115,11 +125,6 @@ class ExtractWavOperator(bpy.types.Operator):
 
                 newstrip = context.scene.sequence_editor.active_strip
 
-                 # deselect all other strips
-                for i in context.selected_editable_sequences:
-                    if i.name != newstrip.name:
-                        i.select=False
-
                 # Update scene
                 context.scene.update()
 
@@ -133,6 +138,13 @@ class ExtractWavOperator(bpy.types.Operator):
                             strip.frame_start + strip.frame_offset_start + \
                             strip.frame_final_duration)
 
+        if jobs:
+            path = os.path.join(bpy.path.abspath(prefs.audio_scripts_path),
+                "jobs.json")
+            proxy_jobs.write_manifest(path, jobs)
+            self.report({'INFO'}, "{} jobs written to {}".format(len(jobs),
+                path))
+
         return {'FINISHED'}
 
 
@@ -250,11 +262,6 @@ class ExternalAudioReloadOperator(bpy.types.Operator):
 
                 newstrip = context.scene.sequence_editor.active_strip
 
-                 # deselect all other strips
-                for i in context.selected_editable_sequences:
-                    if i.name != newstrip.name:
-                        i.select=False
-
                 # Update scene
                 context.scene.update()
 
@@ -311,7 +318,7 @@ class AudioToolPanel(bpy.types.Panel):
 
             if prefs.audio_scripts:
                 layout = self.layout
-                layout.prop(prefs, "audio_scripts_path", text="path for scripts")
+                layout.prop(prefs, "audio_scripts_path", text="path for jobs.json")
 
             layout = self.layout
             layout.prop(prefs, "audio_use_external_links", text="external audio sync")
@@ -0,0 +1,52 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# blender internal proxy worker, not part of the addon modules.
+# CreateBIProxyOperator saves a copy of the blend file and runs
+#   blender -b copy.blend --python bi_proxy_worker.py -- scene strips...
+# in several processes, every one building the proxies and timecode
+# indices of a slice of the selected strips.
+
+import sys
+
+import bpy
+
+
+def main():
+    args = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    if not args:
+        print("bi_proxy_worker: no scene given")
+        sys.exit(1)
+
+    scene = bpy.data.scenes[args[0]]
+    names = set(args[1:])
+    for strip in scene.sequence_editor.sequences_all:
+        strip.select = strip.name in names
+
+    # rebuild_proxy builds the proxies of the selected strips and
+    # waits for them when called from python
+    try:
+        result = bpy.ops.sequencer.rebuild_proxy({"scene": scene})
+    except RuntimeError as e:
+        print("bi_proxy_worker:", e)
+        sys.exit(1)
+    if 'FINISHED' not in result:
+        sys.exit(1)
+
+
+main()
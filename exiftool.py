@@ -221,15 +221,85 @@ class ExifTool(object):
         .. note:: This is considered a low-level method, and should
            rarely be needed by application developers.
         """
+        output = bytearray()
+        for chunk in self.execute_iter(*params):
+            output += chunk
+        return bytes(output).strip()
+
+    def execute_iter(self, *params):
+        """Execute the given batch of parameters and yield the output.
+
+        This method is similar to :py:meth:`execute()`, but instead of
+        collecting the whole output it yields it as ``bytes`` chunks
+        as soon as they are read from ``exiftool``.  The
+        end-of-output sentinel is not included.  Only the last bytes
+        read are kept to look for the sentinel, so memory use does
+        not grow with the size of the output.
+
+        If the generator is closed before the end of the output, the
+        rest of it is read and discarded, so the next command does not
+        get it.  If that fails the process is killed.
+        """
         if not self.running:
             raise ValueError("ExifTool instance not running.")
         self._process.stdin.write(b"\n".join(params + (b"-execute\n",)))
         self._process.stdin.flush()
-        output = b""
         fd = self._process.stdout.fileno()
-        while not output[-32:].strip().endswith(sentinel):
-            output += os.read(fd, block_size)
-        return output.strip()[:-len(sentinel)]
+        # bytes that may be the start of the sentinel, held back until
+        # the next read tells if they are output or not
+        pending = bytearray()
+        complete = False
+        try:
+            while True:
+                data = os.read(fd, block_size)
+                if not data:
+                    complete = True
+                    raise OSError("ExifTool process closed its output.")
+                pending += data
+                tail = bytes(pending[-32:]).rstrip()
+                if tail.endswith(sentinel):
+                    complete = True
+                    end = len(pending.rstrip()) - len(sentinel)
+                    if end > 0:
+                        yield bytes(pending[:end])
+                    return
+                # keep the last bytes, the sentinel may be split between
+                # reads
+                keep = len(sentinel) + 32
+                if len(pending) > keep:
+                    yield bytes(pending[:-keep])
+                    del pending[:-keep]
+        finally:
+            if not complete:
+                self._discard_output(fd, pending)
+
+    def _discard_output(self, fd, pending):
+        """Read and drop the output of the current command up to the
+        end-of-output sentinel.  ``pending`` holds the last bytes read.
+        """
+        keep = len(sentinel) + 32
+        try:
+            while not bytes(pending[-32:]).rstrip().endswith(sentinel):
+                data = os.read(fd, block_size)
+                if not data:
+                    break
+                pending += data
+                del pending[:-keep]
+            else:
+                return
+        except OSError:
+            pass
+        self._kill()
+
+    def _kill(self):
+        """Kill a process whose output can not be read anymore."""
+        try:
+            self._process.kill()
+            self._process.wait()
+        except OSError:
+            pass
+        del self._process
+        self.running = False
 
     def execute_json(self, *params):
         """Execute the given batch of parameters and parse the JSON output.
@@ -256,13 +326,60 @@ class ExifTool(object):
         params = map(fsencode, params)
         return json.loads(self.execute(b"-j", *params).decode("utf-8"))
 
+    def execute_json_iter(self, *params):
+        """Execute the given batch of parameters and yield every object
+        of the JSON output as soon as it is complete.
+
+        This method is similar to :py:meth:`execute_json()`, but the
+        output is parsed incrementally while ``exiftool`` is still
+        writing it, so the first results are available immediately and
+        the whole output is never held in memory.
+        """
+        params = map(fsencode, params)
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder("utf-8")()
+        buf = ""
+        pos = 0
+        for chunk in self.execute_iter(b"-j", *params):
+            buf += text_decoder.decode(chunk)
+            while True:
+                # skip the array delimiters between objects
+                while pos < len(buf) and buf[pos] in " \t\r\n[,]":
+                    pos += 1
+                if pos >= len(buf):
+                    break
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    # incomplete object, wait for more output
+                    break
+                pos = end
+                yield obj
+            buf = buf[pos:]
+            pos = 0
+        buf += text_decoder.decode(b"", True)
+        # an object that never parsed is malformed output, not a
+        # short read
+        if buf.strip(" \t\r\n[,]"):
+            raise ValueError("Malformed ExifTool output: {!r}".format(
+                buf[:80]))
+
+    def iter_metadata_batch(self, filenames):
+        """Yield the meta-data of the given files, one dictionary per
+        file as soon as ``exiftool`` writes it.
+
+        The dictionaries have the format described in the
+        documentation of :py:meth:`execute_json()`.
+        """
+        return self.execute_json_iter(*filenames)
+
     def get_metadata_batch(self, filenames):
         """Return all meta-data for the given files.
 
         The return value will have the format described in the
         documentation of :py:meth:`execute_json()`.
         """
-        return self.execute_json(*filenames)
+        return list(self.iter_metadata_batch(filenames))
 
     def get_metadata(self, filename):
         """Return meta-data for a single file.
@@ -18,6 +18,7 @@
 
 import bpy
 import os.path, operator, subprocess, random
+from concurrent.futures import ThreadPoolExecutor
 
 from bpy.props import IntProperty
 from bpy.props import FloatProperty
@@ -61,46 +62,46 @@ movieextdict = [("1", ".avi", ""),
 
 
 
-def initSceneProperties(context):
-    # initSceneProperties is ONLY for varaibles that should 
-    # be keeped with the blend file. Any other addon preferences
-    # should go to the addon preferences operator in __init__
-    try:
-        if context.scene.kr_scn_init == True:
-            return False
-    except AttributeError:
-        pass
+# version of the scene defaults written by initSceneProperties,
+# increase it when a new scene property needs a per scene default
+scene_properties_version = 1
+
+scene_properties = ("kr_auto_markers", "kr_in_marker", "kr_out_marker",
+    "kr_default_fade_duration", "kr_default_fade_amount", "kr_recursive",
+    "kr_recursive_select_by_extension", "kr_default_ext", "kr_scn_init",
+    "kr_scn_version")
 
-    scn = context.scene
+
+def register_scene_properties():
+    # scene properties are ONLY for varaibles that should 
+    # be keeped with the blend file. Any other addon preferences
+    # should go to the addon preferences operator in __init__.
+    # they are declared once in register(), never at runtime
 
     # JUMP TO CUT
     bpy.types.Scene.kr_auto_markers = BoolProperty(
         name='kr_auto_markers',
         description='activate auto markers',
         default=False)
-    scn.kr_auto_markers = False
     
     bpy.types.Scene.kr_in_marker = IntProperty(
         name='in',
         description='in frame position',
         min=-30000, max=30000,
         default=1)
-    scn.kr_in_marker = 1
     
     bpy.types.Scene.kr_out_marker = IntProperty(
         name='out',
         description='out frame position',
-        min=scn.kr_in_marker, max=30000,
+        min=-30000, max=30000,
         default=75)
-    scn.kr_out_marker = 75
     
     # SEQUENCER EXTRA ACTIONS
     bpy.types.Scene.kr_default_fade_duration = IntProperty(
         name='Duration',
         description='Number of frames to fade',
         min=1, max=250,
-        default=scn.render.fps)
-    scn.kr_default_fade_duration = scn.render.fps
+        default=24)
     
     bpy.types.Scene.kr_default_fade_amount = FloatProperty(
         name='Amount',
@@ -108,32 +109,61 @@ def initSceneProperties(context):
         min=0.0,
         max=100.0,
         default=1.0)
-    scn.kr_default_fade_amount = 1.0
 
     # RECURSIVE LOADER
     bpy.types.Scene.kr_recursive = BoolProperty(
         name='Recursive',
         description='Load in recursive folders',
         default=False)
-    scn.kr_recursive = False
 
     bpy.types.Scene.kr_recursive_select_by_extension = BoolProperty(
         name='Recursive ext',
         description='Load only clips with selected extension',
         default=False)
-    scn.kr_recursive_select_by_extension = False
     
     bpy.types.Scene.kr_default_ext = EnumProperty(
         items=movieextdict,
         name="ext enum",
         default="3")
-    scn.kr_default_ext = "3"
     
+    # set by older versions once the defaults were written
     bpy.types.Scene.kr_scn_init = BoolProperty(
         name='Init',
         default=False)
-    scn.kr_scn_init = True
 
+    bpy.types.Scene.kr_scn_version = IntProperty(
+        name='Version',
+        default=0)
+
+
+def unregister_scene_properties():
+    for name in scene_properties:
+        try:
+            delattr(bpy.types.Scene, name)
+        except AttributeError:
+            pass
+
+
+def initSceneProperties(context):
+    # write the per scene defaults once, scenes are stamped with
+    # scene_properties_version so later calls only read one int
+    scn = context.scene
+    if scn.kr_scn_version >= scene_properties_version:
+        return False
+
+    # scenes initialized by older versions keep their values
+    if not scn.kr_scn_init:
+        scn.kr_auto_markers = False
+        scn.kr_in_marker = 1
+        scn.kr_out_marker = 75
+        scn.kr_default_fade_duration = scn.render.fps
+        scn.kr_default_fade_amount = 1.0
+        scn.kr_recursive = False
+        scn.kr_recursive_select_by_extension = False
+        scn.kr_default_ext = "3"
+        scn.kr_scn_init = True
+
+    scn.kr_scn_version = scene_properties_version
     return True
 
 def get_selected_strips(context):
@@ -247,66 +277,106 @@ def sortlist(filelist):
     filelist_sorted = sorted(filelist, key=operator.itemgetter(1))
     return filelist_sorted
 
-def onefolder(context, recursive_select_by_extension, ext):
+# every extension in movieextdict, to test files with a single lookup
+movie_extensions = frozenset(i[1] for i in movieextdict)
+
+# directory listings from previous scans: path -> (mtime, files, dirs)
+# a directory is only listed again when its mtime changes
+scan_cache = {}
+
+# threads listing sibling directories at the same time, directory
+# listing is bound by disk or network latency, not by cpu
+scan_workers = 8
+
+
+def get_extensions(recursive_select_by_extension, ext):
     '''
-    returns a list of MOVIE type files from folder selected in file browser
+    returns the set of extensions to load
+    '''
+    if recursive_select_by_extension == True:
+        for i in movieextdict:
+            if i[0] == ext:
+                return frozenset([i[1]])
+    return movie_extensions
+
+def listdir(path, use_cache=True):
+    '''
+    returns two lists with the names of the files and the directories
+    inside path. Symbolic links to directories are not followed
+    '''
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return [], []
+    if use_cache:
+        entry = scan_cache.get(path)
+        if entry is not None and entry[0] == mtime:
+            return entry[1], entry[2]
+
+    files = []
+    dirs = []
+    try:
+        for entry in os.scandir(path):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                elif entry.is_file():
+                    files.append(entry.name)
+            except OSError:
+                pass
+    except OSError:
+        return [], []
+    scan_cache[path] = (mtime, files, dirs)
+    return files, dirs
+
+def scan_media(path, extensions, recursive=True, use_cache=True):
+    '''
+    returns a list of tuplas (path, filename) with the files inside path
+    matching extensions. Sibling directories are listed in parallel
     '''
     filelist = []
+    level = [path]
+    with ThreadPoolExecutor(max_workers=scan_workers) as executor:
+        while level:
+            listings = executor.map(lambda p: listdir(p, use_cache), level)
+            next_level = []
+            for root, (files, dirs) in zip(level, listings):
+                for file in files:
+                    if os.path.splitext(file)[1].lower() in extensions:
+                        filelist.append((root, file))
+                if recursive:
+                    next_level.extend(os.path.join(root, d) for d in dirs)
+            level = next_level
+    return filelist
+
+def onefolder(context, recursive_select_by_extension, ext, use_cache=True):
+    '''
+    returns a list of MOVIE type files from folder selected in file browser
+    '''
     path, filename = getfilepathfrombrowser(context)
-    
-    for i in movieextdict: 
-        if i[0] == ext:
-            extension = i[1].rpartition(".")[2]
-            break
 
-    scn = context.scene
+    if detect_strip_type(path + filename) != 'MOVIE':
+        return []
+    extensions = get_extensions(recursive_select_by_extension, ext)
+    return scan_media(path, extensions, False, use_cache)
 
-    if detect_strip_type(path + filename) == 'MOVIE':
-        if recursive_select_by_extension == True:
-            #filtering by extension...
-            for file in os.listdir(path):
-                if file.rpartition(".")[2].lower() == extension:
-                    filelist.append((path, file))
-        else:
-            #looking for all known extensions
-            for file in os.listdir(path):
-                for i in movieextdict:
-                    if file.rpartition(".")[2].lower() == i[1].rpartition(".")[2]:
-                        filelist.append((path, file))
-    return (filelist)
-
-def recursive(context, recursive_select_by_extension, ext):
+def recursive(context, recursive_select_by_extension, ext, use_cache=True):
     '''
     returns a list of MOVIE type files recursively from file browser
     '''
-    filelist = []
     path = getpathfrombrowser(context)
-    
-    for i in movieextdict:
-        if i[0] == ext:
-            extension = i[1].rpartition(".")[2]
-            break
-    
-    scn = context.scene        
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            if recursive_select_by_extension == True:
-                #filtering by extension...
-                if file.rpartition(".")[2].lower() == extension:
-                    filelist.append((root, file))
-            else:
-                #looking for all known extensions
-                for i in movieextdict:
-                    if file.rpartition(".")[2].lower() == i[1].rpartition(".")[2]:
-                        filelist.append((root, file))
-    return filelist   
+    extensions = get_extensions(recursive_select_by_extension, ext)
+    return scan_media(path, extensions, True, use_cache)
 
 # jump to cut functions
 
 def triminout(strip, sin, sout):
 
     """trim the strip to in and out, and returns 
-    true if the strip is outside given in and out"""
+    true if the strip is outside given in and out.
+    handles are set through the data api, so the strip
+    does not need to be selected. effect strips with
+    inputs get their length from them and are not trimmed"""
     
     start = strip.frame_start + strip.frame_offset_start - strip.frame_still_start
     end = start + strip.frame_final_duration
@@ -315,22 +385,42 @@ def triminout(strip, sin, sout):
     if end < sin: remove = True
     if start > sout: remove = True
     
+    if getattr(strip, "input_count", 0) > 0:
+        return remove
+
     if end > sin:
         if start < sin:
-            strip.select_right_handle = False
-            strip.select_left_handle = True
-            bpy.ops.sequencer.snap(frame=sin)
-            strip.select_left_handle = False
+            strip.frame_final_start = sin
     if start < sout:
         if end > sout:
-            strip.select_left_handle = False
-            strip.select_right_handle = True
-            bpy.ops.sequencer.snap(frame=sout)
-            strip.select_right_handle = False
+            strip.frame_final_end = sout
 
     return remove
 
 
+def trim_strips(strips, sin, sout):
+
+    """trim all the strips to in and out, returns the list
+    of strips outside in and out, that should be removed"""
+
+    return [i for i in strips if triminout(i, sin, sout)]
+
+
+def delete_strips(context, strips):
+
+    """delete all the strips with a single operator call.
+    strips must be in the current meta level"""
+
+    strips = list(strips)
+    if not strips:
+        return
+    for i in context.scene.sequence_editor.sequences_all:
+        i.select = False
+    for i in strips:
+        i.select = True
+    bpy.ops.sequencer.delete()
+
+
 #------------ random editor functions.
 
 def randompartition(lst,n,rand):
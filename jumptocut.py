@@ -121,23 +121,13 @@ class OBJECT_OT_Triminout(bpy.types.Operator):
         markers=scene.timeline_markers
         sin=markers["IN"].frame
         sout=markers["OUT"].frame
-        strips = context.selected_editable_sequences
-        #(triminout function only works fine 
-        # with one strip selected at a time)
-        for strip in strips:
-            #deselect all other strips 
-            for i in strips: i.select = False
-            #select current strip
-            strip.select = True
-            remove=functions.triminout(strip,sin,sout)
-            if remove == True:
-                bpy.ops.sequencer.delete()
+        strips = list(context.selected_editable_sequences)
+        rmlist = functions.trim_strips(strips, sin, sout)
+        functions.delete_strips(context, rmlist)
         #select all strips again
         for strip in strips:
-            try: 
+            if strip not in rmlist:
                 strip.select=True
-            except ReferenceError:
-                pass
         bpy.ops.sequencer.reload()
         return {'FINISHED'}      
 
@@ -339,158 +329,58 @@ class OBJECT_OT_Unmetatrim(bpy.types.Operator):  #Operator paste source in/out
     def execute(self, context):
         scn=context.scene
         seq=scn.sequence_editor
-        markers=scn.timeline_markers
-
-        # setting in and out around meta
-        # while keeping data to restore in and out positions
-        strip = seq.active_strip
-        sin = strip.frame_start + strip.frame_offset_start
-        sout = sin + strip.frame_final_duration
-        
-        borrarin=False
-        borrarout=False
-        original_in = 0
-        original_out = 0
-
-        if "IN" in markers:
-            original_in = markers["IN"].frame
-            markers["IN"].frame = sin
-        else:
-            mark=markers.new(name="IN")
-            mark.frame=sin
-            borrarin=True
 
-        if "OUT" in markers:
-            original_out = markers["OUT"].frame
-            markers["OUT"].frame=sout
-        else:
-            mark= markers.new(name="OUT")
-            mark.frame=sout
-            borrarout=True
-
-        
-        # here starts the operator...
-        
         #get all META from selected strips
         metastrips=[]
         for i in context.selected_editable_sequences:
             if i.type == "META":
                 metastrips.append(i) 
-        
-        for meta in metastrips:
-            bpy.ops.sequencer.reload()  
 
-            # deselect all strips 
-            for i in context.selected_editable_sequences:
-                i.select = False
+        # first compute the channels and the trims of every meta
+        # content, then apply everything through the data api, so
+        # the only operators called are one meta_separate per meta
+        # and a single delete for the strips outside the metas
+        plan = []
+        for meta in metastrips:
+            sin = meta.frame_final_start
+            sout = meta.frame_final_end
+            newstrips = list(meta.sequences)
+            if not newstrips:
+                continue
+            lowerchan = min(i.channel for i in newstrips)
+            upperchan = max(i.channel for i in newstrips)
+            #channel increment needed to place the content at meta channel
+            deltachan = meta.channel - lowerchan
+            #channels above the content, to avoid collisions while moving
+            delta = upperchan - lowerchan + 1
+            plan.append((meta, sin, sout, newstrips, deltachan, delta))
 
-            #make active current meta
-            meta.select = True
-            seq.active_strip = meta
-            bpy.ops.sequencer.reload()
-
-            #set in and out to meta
-            sin = meta.frame_start + meta.frame_offset_start
-            sout = sin + meta.frame_final_duration
-            #print("meta: ", sin, sout)
-
-            #grab meta content
-            newstrips = []
-            for i in meta.sequences:
-                newstrips.append(i)
-
-            #store meta channel
-            basechan = meta.channel
-            #look for upper and lower channels used by strips inside the meta
-            lowerchan = 32
-            upperchan = 0
-            for i in newstrips:
-                if i.channel < lowerchan: lowerchan = i.channel
-                if i.channel > upperchan: upperchan = i.channel
-            #calculate channel increment needed
-            deltachan =  basechan - lowerchan  
+        rmlist = []
+        keep = []
+        for meta, sin, sout, newstrips, deltachan, delta in plan:
             # reorder strips inside the meta
-            # before separate we need to store channel data
-            delta = upperchan - lowerchan + 1
             for i in newstrips:
                 i.channel = i.channel + delta
-            chandict = {}
             for i in newstrips:
                 i.channel = i.channel + deltachan - delta
-                chandict[i.name]=i.channel
-            #for i in chandict: print(i,chandict[i])
-
-            #go inside meta to trim strips
-            bpy.ops.sequencer.meta_toggle()
-
-            #update seq definition according to meta
-            meta_level = len(seq.meta_stack)
-            if meta_level > 0:
-                seq = seq.meta_stack[meta_level - 1]
-
-            #create a list to store clips outside selection
-            #that will be removed
-            rmlist=[]
-            #deselect all separated strips
-            for j in newstrips:
-                j.select = False
-                #print("newstrips: ",j.name, j.type)
-            #trim each strip separately
-            #first check special strips:
-            # (those who can move when any other does)
-            for i in newstrips:
-                if i.type in {"CROSS","SPEED","WIPE"}:
-                    i.select = True
-                    remove = functions.triminout(i,sin,sout)
-                    if remove == True:
-                        #print("checked: ",i.name, i.type)
-                        rmlist.append(i)
-                    i.select=False
-            # now for the rest of strips
-            for i in newstrips:
-                i.select = True
-                remove = functions.triminout(i,sin,sout)
-                if remove == True:
-                    #print("checked: ",i.name, i.type)
-                    rmlist.append(i)
-                i.select=False
-
-            # back outside the meta and separate it
-            bpy.ops.sequencer.meta_toggle()
-            bpy.ops.sequencer.meta_separate()
-
-            # reset seq definition
-            seq=scn.sequence_editor
 
-            #remove strips from outside the meta duration
-            for i in rmlist:
-                #print("removing: ",i.name, i.type)
-                for j in scn.sequence_editor.sequences_all: j.select = False
-                i.select = True
-                scn.sequence_editor.active_strip = i
-                bpy.ops.sequencer.delete()
+            removed = functions.trim_strips(newstrips, sin, sout)
+            rmlist.extend(removed)
+            removed = set(i.name for i in removed)
+            keep.extend(i for i in newstrips if i.name not in removed)
 
-            #select all strips and set one of the strips as active
-            for i in newstrips:
-                if i not in rmlist:
-                    i.select = True
-                    scn.sequence_editor.active_strip = i 
+            seq.active_strip = meta
+            bpy.ops.sequencer.meta_separate()
 
-            bpy.ops.sequencer.reload()
+        #remove strips from outside the meta duration
+        functions.delete_strips(context, rmlist)
 
-            #restore original IN and OUT values
-            if borrarin:
-                markers.remove(markers['IN'])
-            else:
-                markers["IN"].frame = original_in
-            if borrarout:
-                markers.remove(markers['OUT'])
-            else:
-                markers["OUT"].frame = original_out
-            scn.update()
-            
-    
+        #select all strips and set one of the strips as active
+        for i in keep:
+            i.select = True
+            seq.active_strip = i
 
+        bpy.ops.sequencer.reload()
         return {'FINISHED'}
 
 class OBJECT_OT_Extrasnap(bpy.types.Operator):  #Operator paste source in/out
@@ -602,44 +492,75 @@ class OBJECT_OT_Extrahandles(bpy.types.Operator):  #Operator paste source in/out
 
 
 
+# scenes whose properties were checked by the handler, the handler
+# runs on every scene update (every frame while playing) and only
+# touches the markers when they are not at the property frames
+marker_state = {}
+# calls: handler runs, skipped: runs with nothing to do,
+# updates: runs that moved the markers
+marker_handler_stats = {"calls": 0, "skipped": 0, "updates": 0}
+
+
 @persistent
 def marker_handler(scn):
-    context=bpy.context
-    functions.initSceneProperties(context)
-    #preferences = context.user_preferences
-    #prefs = preferences.addons[__package__].preferences 
-    if scn.kr_auto_markers:
-        #scn = context.scene
-        
-        markers =scn.timeline_markers
-        
-        if "IN" in markers:
-            mark=markers["IN"]
-            mark.frame=scn.kr_in_marker
-        else:
-            mark=markers.new(name="IN")
-            mark.frame=scn.kr_in_marker           
+    marker_handler_stats["calls"] += 1
+    if scn.name not in marker_state:
+        functions.initSceneProperties(bpy.context)
+        marker_state[scn.name] = True
 
-        if "OUT" in markers:
-            mark=markers["OUT"]
-            mark.frame=scn.kr_out_marker
-        else:
-            mark= markers.new(name="OUT")
-            mark.frame=scn.kr_out_marker
-
-        #limit OUT marker position with IN marker
-        if scn.kr_in_marker > scn.kr_out_marker:
-            scn.kr_out_marker = scn.kr_in_marker
+    if not scn.kr_auto_markers:
+        marker_handler_stats["skipped"] += 1
+        return {'CANCELLED'}
 
-        return {'FINISHED'}      
-    else:
+    #limit OUT marker position with IN marker
+    if scn.kr_in_marker > scn.kr_out_marker:
+        scn.kr_out_marker = scn.kr_in_marker
+
+    # markers dragged or deleted by hand are put back too
+    markers = scn.timeline_markers
+    mark_in = markers.get("IN")
+    mark_out = markers.get("OUT")
+    if mark_in is not None and mark_out is not None and \
+        (mark_in.frame, mark_out.frame) == (scn.kr_in_marker,
+        scn.kr_out_marker):
+        marker_handler_stats["skipped"] += 1
         return {'CANCELLED'}
 
-bpy.app.handlers.scene_update_post.append(marker_handler)
+    if mark_in is None:
+        mark_in = markers.new(name="IN")
+    if mark_in.frame != scn.kr_in_marker:
+        mark_in.frame = scn.kr_in_marker
+
+    if mark_out is None:
+        mark_out = markers.new(name="OUT")
+    if mark_out.frame != scn.kr_out_marker:
+        mark_out.frame = scn.kr_out_marker
+
+    marker_handler_stats["updates"] += 1
+    return {'FINISHED'}
 
 
+@persistent
+def marker_state_reset(dummy):
+    # scenes of a newly loaded file may share names with the old ones
+    marker_state.clear()
+
 
+marker_handlers = ((bpy.app.handlers.scene_update_post, marker_handler),
+    (bpy.app.handlers.load_post, marker_state_reset))
 
 
+def register_handlers():
+    # do not stack handlers when the addon is reloaded
+    for handlers, handler in marker_handlers:
+        for i in list(handlers):
+            if getattr(i, "__name__", "") == handler.__name__:
+                handlers.remove(i)
+        handlers.append(handler)
 
 
+def unregister_handlers():
+    # the handlers read the scene properties removed by unregister()
+    for handlers, handler in marker_handlers:
+        if handler in handlers:
+            handlers.remove(handler)
@@ -0,0 +1,559 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# metadata extraction shared by every operator.
+# exiftool runs in batch mode (-stay_open), so instead of launching a
+# perl interpreter on every click we keep a pool of running exiftool
+# processes that is started lazily and shut down in unregister().
+# parsed results are stored in an on disk cache keyed by file path,
+# size and mtime, so reading the same files again costs no subprocess.
+
+import os
+import json
+import hashlib
+import threading
+import subprocess
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from . import exiftool
+
+
+def default_pool_size():
+    try:
+        return max(1, min(4, multiprocessing.cpu_count()))
+    except NotImplementedError:
+        return 1
+
+
+class ExifToolPool(object):
+    '''
+    a pool of long lived ExifTool instances. Use get() to borrow one:
+
+        with pool.get() as et:
+            et.get_metadata(filename)
+    '''
+
+    def __init__(self, size=None):
+        self.size = size or default_pool_size()
+        self._idle = []
+        self._started = 0
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def is_alive(et):
+        return et.running and et._process.poll() is None
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                while self._idle:
+                    et = self._idle.pop()
+                    if self.is_alive(et):
+                        return et
+                    # died meanwhile, replace it
+                    self._started -= 1
+                if self._started < self.size:
+                    self._started += 1
+                    break
+                self._cond.wait()
+
+        et = exiftool.ExifTool()
+        try:
+            et.start()
+        except OSError:
+            with self._cond:
+                self._started -= 1
+                self._cond.notify()
+            raise
+        return et
+
+    def release(self, et, broken=False):
+        if broken or not self.is_alive(et):
+            try:
+                et.terminate()
+            except (OSError, ValueError):
+                pass
+            with self._cond:
+                self._started -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append(et)
+            self._cond.notify()
+
+    @contextmanager
+    def get(self):
+        et = self.acquire()
+        # any error while a command runs (broken pipe, bad output) may
+        # leave output of the command unread, the process can not be
+        # trusted anymore
+        broken = True
+        try:
+            yield et
+            broken = False
+        finally:
+            self.release(et, broken)
+
+    def map(self, func, items, fallback=None):
+        '''
+        calls func(et, item) for every item using all the pool
+        processes at once, returns the results in the same order
+        '''
+        items = list(items)
+        if len(items) < 2:
+            return [self.call(func, i, fallback) for i in items]
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(executor.map(
+                lambda i: self.call(func, i, fallback), items))
+
+    def call(self, func, item, fallback=None):
+        '''
+        returns func(et, item). With a fallback, items exiftool writes
+        unreadable output for (ValueError) get fallback() instead
+        '''
+        try:
+            with self.get() as et:
+                return func(et, item)
+        except ValueError as Err:
+            if fallback is None:
+                raise
+            print(Err)
+            return fallback()
+
+    def shutdown(self):
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+            self._started -= len(idle)
+        for et in idle:
+            try:
+                et.terminate()
+            except (OSError, ValueError):
+                pass
+
+
+_pool = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ExifToolPool()
+    return _pool
+
+
+def shutdown():
+    global _pool
+    close_frame_store()
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def check_exiftool():
+    '''
+    returns False if exiftool cannot be started
+    '''
+    try:
+        with get_pool().get():
+            return True
+    except OSError:
+        return False
+
+
+# largest number of files sent to one exiftool command
+max_chunk_size = 500
+
+
+def get_metadata_batch(filenames):
+    '''
+    returns the metadata of all the files, read by one exiftool process
+    '''
+    with get_pool().get() as et:
+        return et.get_metadata_batch(filenames)
+
+
+def get_metadata_chunked(filenames, chunk_size=None):
+    '''
+    returns the metadata of many files (i.e. the elements of an image
+    sequence strip) splitting them in chunks that are read at the same
+    time by the pool processes. Results are merged back in order
+    '''
+    filenames = list(filenames)
+    pool = get_pool()
+    if chunk_size is None:
+        # a few chunks per process, so a slow chunk does not hold the rest
+        chunk_size = max(1, min(max_chunk_size,
+            -(-len(filenames) // (pool.size * 4))))
+    chunks = [filenames[i:i + chunk_size]
+        for i in range(0, len(filenames), chunk_size)]
+
+    def read(et, chunk):
+        return list(et.iter_metadata_batch(chunk))
+
+    data = []
+    for result in pool.map(read, chunks, fallback=list):
+        data.extend(result)
+    return data
+
+
+def get_metadata_files(filenames):
+    '''
+    returns the metadata of every file, fanning out over the pool.
+    Files exiftool cannot read get an empty dict
+    '''
+    def read(et, filename):
+        try:
+            return et.get_metadata(filename)
+        except IndexError:
+            # no output for the file
+            return {}
+    return get_pool().map(read, filenames, fallback=dict)
+
+
+# media probing with ffprobe. Every probe is a separate process, the
+# threads only wait for them, so probing many files scales with the
+# number of cores.
+
+ffprobe_executable = "ffprobe"
+
+
+def probe_media(filename):
+    '''
+    returns a dict with the number of frames and the frame rate of the
+    first video stream of the file, or None if ffprobe cannot read it
+    '''
+    command = [ffprobe_executable, "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=nb_frames,r_frame_rate,duration:format=duration",
+        "-of", "json", filename]
+    try:
+        output = subprocess.check_output(command, stdin=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+        info = json.loads(output.decode("utf-8"))
+        stream = info["streams"][0]
+        num, den = stream["r_frame_rate"].split("/")
+        fps = float(num) / float(den)
+        frames = int(stream.get("nb_frames", 0) or 0)
+        if frames <= 0:
+            duration = stream.get("duration") or info["format"]["duration"]
+            frames = int(round(float(duration) * fps))
+    except (OSError, subprocess.CalledProcessError, ValueError, KeyError,
+        IndexError, ZeroDivisionError):
+        return None
+    return {"frames": frames, "fps": fps}
+
+
+def probe_keyframes(filename):
+    '''
+    returns the times in seconds of the keyframes of the first video
+    stream, counted from the first one, or None if ffprobe fails.
+    only packets are read, no frame is decoded
+    '''
+    command = [ffprobe_executable, "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", filename]
+    try:
+        output = subprocess.check_output(command, stdin=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    times = []
+    for line in output.decode("utf-8", "replace").splitlines():
+        pts, sep, flags = line.partition(",")
+        if not flags.startswith("K"):
+            continue
+        try:
+            times.append(float(pts))
+        except ValueError:
+            # N/A timestamps
+            pass
+    if not times:
+        return None
+    times.sort()
+    return [i - times[0] for i in times]
+
+
+def probe_media_files(filenames, workers=None, probe=probe_media):
+    '''
+    returns probe(filename) for every file, probing them in parallel
+    '''
+    filenames = list(filenames)
+    if not filenames:
+        return []
+    workers = workers or max(1, multiprocessing.cpu_count())
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(probe, filenames))
+
+
+def default_cache_directory():
+    cache_home = os.environ.get("XDG_CACHE_HOME",
+        os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "kinoraw_tools", "metadata")
+
+
+def file_identity(filename):
+    st = os.stat(filename)
+    return [st.st_size, st.st_mtime]
+
+
+class MetadataCache(object):
+    '''
+    exiftool results stored as one json file per source file, keyed
+    by path. An entry is only valid while the source keeps the same
+    size and mtime
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def entry_path(self, filename):
+        digest = hashlib.sha1(filename.encode("utf-8", "surrogateescape"))
+        digest = digest.hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + ".json")
+
+    def get(self, filename):
+        '''
+        returns the cached metadata of the file, or None
+        '''
+        try:
+            identity = file_identity(filename)
+        except OSError:
+            return None
+
+        with self._lock:
+            entry = self._memory.get(filename)
+        if entry is None:
+            try:
+                with open(self.entry_path(filename)) as f:
+                    entry = json.load(f)
+            except (IOError, OSError, ValueError):
+                return None
+
+        if entry["identity"] != identity:
+            self.invalidate(filename)
+            return None
+        with self._lock:
+            self._memory[filename] = entry
+        return entry["data"]
+
+    def get_many(self, filenames):
+        '''
+        returns a dict with the cached metadata of the given files,
+        files not in the cache are left out
+        '''
+        found = {}
+        for filename in filenames:
+            data = self.get(filename)
+            if data is not None:
+                found[filename] = data
+        return found
+
+    def put(self, filename, data):
+        try:
+            entry = {"identity": file_identity(filename), "data": data}
+        except OSError:
+            return
+        with self._lock:
+            self._memory[filename] = entry
+        path = self.entry_path(filename)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        except (IOError, OSError):
+            pass
+
+    def invalidate(self, filename):
+        with self._lock:
+            self._memory.pop(filename, None)
+        try:
+            os.remove(self.entry_path(filename))
+        except OSError:
+            pass
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = MetadataCache(default_cache_directory())
+    return _cache
+
+
+def path_key(filename):
+    return os.path.normcase(os.path.normpath(filename))
+
+
+def read_metadata(filenames):
+    '''
+    returns the metadata of every file in the same order, reading from
+    the cache and asking exiftool only for the missing files.
+    Files exiftool cannot read get an empty dict. Raises OSError if
+    exiftool cannot run
+    '''
+    filenames = list(filenames)
+    cache = get_cache()
+    found = cache.get_many(filenames)
+    missing = [i for i in filenames if i not in found]
+
+    try:
+        if len(missing) > get_pool().size:
+            data = get_metadata_chunked(missing)
+        else:
+            data = get_metadata_files(missing)
+    except ValueError as Err:
+        # unreadable exiftool output, the process was replaced
+        print(Err)
+        data = []
+
+    # exiftool skips the files it can not read, match them by name.
+    # SourceFile uses forward slashes on windows
+    wanted = dict((path_key(i), i) for i in missing)
+    for d in data:
+        filename = wanted.get(path_key(d.get("SourceFile", "")))
+        if filename is not None:
+            found[filename] = d
+            cache.put(filename, d)
+    return [found.get(i, {}) for i in filenames]
+
+
+class FrameMetadataStore(object):
+    '''
+    metadata of the files of one strip, indexed by frame and read only
+    around the frames that are asked for. prefetch() reads the next
+    frames in a background thread, so playback does not wait for
+    exiftool. Nothing of this is stored in the blend file
+    '''
+
+    # frames read at once when a frame is not available
+    window = 8
+    # frames read in background ahead of the playhead
+    ahead = 48
+    # frames kept in memory, the farthest from the playhead are dropped
+    max_frames = 2000
+
+    def __init__(self, key, filenames, frame_start=0):
+        self.key = key
+        self.filenames = list(filenames)
+        self.frame_start = frame_start
+        self._frames = {}
+        self._pending = set()
+        # set when frames were read in background, cleared by the ui
+        self.updated = False
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def get(self, index):
+        '''
+        returns the metadata of the file shown at index, reading it
+        (and the following ones) if needed
+        '''
+        if not 0 <= index < len(self.filenames):
+            return None
+        with self._lock:
+            data = self._frames.get(index)
+        if data is None:
+            self.fetch(range(index, min(index + self.window,
+                len(self.filenames))))
+            with self._lock:
+                data = self._frames.get(index)
+        return data
+
+    def peek(self, index):
+        '''
+        returns the metadata of the file shown at index if it was
+        already read, or None
+        '''
+        with self._lock:
+            return self._frames.get(index)
+
+    def fetch(self, indexes):
+        indexes = [i for i in indexes if i not in self._frames]
+        if not indexes:
+            return
+        try:
+            data = read_metadata([self.filenames[i] for i in indexes])
+        except (OSError, ValueError):
+            data = [{} for i in indexes]
+        with self._lock:
+            for i, d in zip(indexes, data):
+                self._frames[i] = d
+                self._pending.discard(i)
+            self.trim(indexes[0])
+        self.updated = True
+
+    def prefetch(self, index):
+        '''
+        reads in background the frames after index that are not loaded
+        '''
+        with self._lock:
+            indexes = [i for i in range(max(0, index),
+                min(index + self.ahead, len(self.filenames)))
+                if i not in self._frames and i not in self._pending]
+            self._pending.update(indexes)
+        if indexes:
+            self._executor.submit(self.fetch, indexes)
+
+    def trim(self, index):
+        # called with the lock held
+        if len(self._frames) <= self.max_frames:
+            return
+        farthest = sorted(self._frames, key=lambda i: abs(i - index))
+        for i in farthest[self.max_frames:]:
+            del self._frames[i]
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+_frame_store = None
+
+
+def get_frame_store(key, filenames_func, frame_start=0):
+    '''
+    returns the frame store for key, building a new one with the list
+    returned by filenames_func() if the current store is for other key
+    '''
+    global _frame_store
+    if _frame_store is None or _frame_store.key != key:
+        close_frame_store()
+        _frame_store = FrameMetadataStore(key, filenames_func(), frame_start)
+    _frame_store.frame_start = frame_start
+    return _frame_store
+
+
+def current_frame_store():
+    return _frame_store
+
+
+def close_frame_store():
+    global _frame_store
+    if _frame_store is not None:
+        _frame_store.close()
+        _frame_store = None
@@ -30,6 +30,7 @@ from bpy.props import StringProperty
 
 from . import functions
 from . import exiftool
+from .strip_index import StripIndex
 
 # ------------------------------
 
@@ -73,21 +74,10 @@ class Sequencer_Extra_TrimTimeline(bpy.types.Operator):
         if meta_level > 0:
             seq = seq.meta_stack[meta_level - 1]
 
-        frame_start = 300000
-        frame_end = -300000
-        for i in seq.sequences:
-            try:
-                if i.frame_final_start < frame_start:
-                    frame_start = i.frame_final_start
-                if i.frame_final_end > frame_end:
-                    frame_end = i.frame_final_end - 1
-            except AttributeError:
-                    pass
-
-        if frame_start != 300000:
-            scn.frame_start = frame_start
-        if frame_end != -300000:
-            scn.frame_end = frame_end
+        bounds = StripIndex(seq.sequences).bounds()
+        if bounds is not None:
+            scn.frame_start = bounds[0]
+            scn.frame_end = bounds[1] - 1
             
         bpy.ops.sequencer.view_all()
 
@@ -475,36 +465,26 @@ class Sequencer_Extra_RippleDelete(bpy.types.Operator):
         meta_level = len(seq.meta_stack)
         if meta_level > 0:
             seq = seq.meta_stack[meta_level - 1]
-        #strip = functions.act_strip(context)
-        for strip in context.selected_editable_sequences:
-            cut_frame = strip.frame_final_start
-            next_edit = 300000
-            bpy.ops.sequencer.select_all(action='DESELECT')
+        # all the selected strips are deleted at once, then every
+        # following strip is moved back once by the length of all the
+        # gaps before it
+        strips = list(context.selected_editable_sequences)
+        cuts = [strip.frame_final_start for strip in strips]
+        bpy.ops.sequencer.select_all(action='DESELECT')
+        for strip in strips:
             strip.select = True
-            bpy.ops.sequencer.delete()
-            striplist = []
-            for i in seq.sequences:
-                try:
-                    if (i.frame_final_start > cut_frame
-                    and not i.mute):
-                        if i.frame_final_start < next_edit:
-                            next_edit = i.frame_final_start
-                    if not i.mute:
-                        striplist.append(i)
-                except AttributeError:
-                        pass
+        bpy.ops.sequencer.delete()
 
-            if next_edit == 300000:
-                return {'FINISHED'}
-            ripple_length = next_edit - cut_frame
-            for i in range(len(striplist)):
-                str = striplist[i]
-                try:
-                    if str.frame_final_start > cut_frame:
-                        str.frame_start = str.frame_start - ripple_length
-                except AttributeError:
-                        pass
-            bpy.ops.sequencer.reload()
+        index = StripIndex(seq.sequences, skip_muted=True)
+        gaps = index.ripple_gaps(cuts)
+        if not gaps:
+            return {'FINISHED'}
+        for strip, offset in index.ripple_offsets(gaps):
+            try:
+                strip.frame_start -= offset
+            except AttributeError:
+                    pass
+        bpy.ops.sequencer.reload()
         return {'FINISHED'}
 
 
@@ -573,33 +553,18 @@ class Sequencer_Extra_Insert(bpy.types.Operator):
         bpy.ops.sequencer.select_all(action='DESELECT')
         current_frame = scn.frame_current
 
-        striplist = []
-        for i in seq.sequences:
-            try:
-                if (i.frame_final_start >= current_frame
-                and not i.mute):
-                    if self.singlechannel == True:
-                        if i.channel == strip.channel:
-                            striplist.append(i)
-                    else:
-                        striplist.append(i)
-            except AttributeError:
-                    pass
-        try:
-            bpy.ops.sequencerextra.selectcurrentframe('EXEC_DEFAULT',
-            mode='AFTER')
-        except:
-            self.report({'ERROR_INVALID_INPUT'}, 'Execution Error, '\
-            'check your Blender version')
-            return {'CANCELLED'}
+        index = StripIndex(seq.sequences, skip_muted=True)
+        if self.singlechannel == True:
+            striplist = index.channel_starting_from(strip.channel,
+                current_frame)
+        else:
+            striplist = index.starting_from(current_frame)
 
-        for i in range(len(striplist)):
-            str = striplist[i]
-            try:
-                if str.select == True:
-                    str.frame_start += gap
-            except AttributeError:
-                    pass
+        # same selection as selectcurrentframe mode='AFTER'
+        for i in index.starting_from(current_frame):
+            i.select = True
+        for i in striplist:
+            i.frame_start += gap
         try:
             diff = current_frame - strip.frame_final_start
             strip.frame_start += diff
@@ -614,57 +579,109 @@ class Sequencer_Extra_Insert(bpy.types.Operator):
 
 
 # COPY STRIP PROPERTIES
-class Sequencer_Extra_CopyProperties(bpy.types.Operator):
-    bl_label = 'Copy Properties'
-    bl_idname = 'sequencerextra.copyproperties'
-    bl_description = 'Copy properties of active strip to selected strips'
-    bl_options = {'REGISTER', 'UNDO'}
 
-    prop = EnumProperty(
-    name='Property',
-    items=[
+# (group, label, rna paths copied from the active strip), paths are
+# relative to the strip and copied in order
+copy_properties_table = (
     # COMMON
-    ('name', 'Name', ''),
-    ('blend_alpha', 'Opacity', ''),
-    ('blend_type', 'Blend Mode', ''),
-    ('animation_offset', 'Input - Trim Duration', ''),
+    ('name', 'Name', ('name',)),
+    ('blend_alpha', 'Opacity', ('blend_alpha',)),
+    ('blend_type', 'Blend Mode', ('blend_type',)),
+    ('animation_offset', 'Input - Trim Duration',
+        ('animation_offset_start', 'animation_offset_end')),
     # NON-SOUND
-    ('use_translation', 'Input - Image Offset', ''),
-    ('crop', 'Input - Image Crop', ''),
-    ('proxy', 'Proxy / Timecode', ''),
-    ('strobe', 'Filter - Strobe', ''),
-    ('color_multiply', 'Filter - Multiply', ''),
-    ('color_saturation', 'Filter - Saturation', ''),
-    ('deinterlace', 'Filter - De-Interlace', ''),
-    ('flip', 'Filter - Flip', ''),
-    ('float', 'Filter - Convert Float', ''),
-    ('alpha_mode', 'Filter - Alpha Mode', ''),
-    ('reverse', 'Filter - Backwards', ''),
+    ('use_translation', 'Input - Image Offset',
+        ('use_translation', 'transform.offset_x', 'transform.offset_y')),
+    ('crop', 'Input - Image Crop',
+        ('use_crop', 'crop.min_x', 'crop.min_y', 'crop.max_x', 'crop.max_y')),
+    ('proxy', 'Proxy / Timecode',
+        ('use_proxy', 'use_proxy_custom_directory', 'use_proxy_custom_file',
+        'proxy.build_100', 'proxy.build_25', 'proxy.build_50',
+        'proxy.build_75', 'proxy.directory', 'proxy.filepath',
+        'proxy.quality', 'proxy.timecode', 'proxy.use_overwrite')),
+    ('strobe', 'Filter - Strobe', ('strobe',)),
+    ('color_multiply', 'Filter - Multiply', ('color_multiply',)),
+    ('color_saturation', 'Filter - Saturation', ('color_saturation',)),
+    ('deinterlace', 'Filter - De-Interlace', ('use_deinterlace',)),
+    ('flip', 'Filter - Flip', ('use_flip_x', 'use_flip_y')),
+    ('float', 'Filter - Convert Float', ('use_float',)),
+    ('alpha_mode', 'Filter - Alpha Mode', ('alpha_mode',)),
+    ('reverse', 'Filter - Backwards', ('use_reverse_frames',)),
     # SOUND
-    ('pan', 'Sound - Pan', ''),
-    ('pitch', 'Sound - Pitch', ''),
-    ('volume', 'Sound - Volume', ''),
-    ('cache', 'Sound - Caching', ''),
+    ('pan', 'Sound - Pan', ('pan',)),
+    ('pitch', 'Sound - Pitch', ('pitch',)),
+    ('volume', 'Sound - Volume', ('volume',)),
+    ('cache', 'Sound - Caching', ('use_memory_cache',)),
     # IMAGE
-    ('directory', 'Image - Directory', ''),
+    ('directory', 'Image - Directory', ('directory',)),
     # MOVIE
-    ('mpeg_preseek', 'Movie - MPEG Preseek', ''),
-    ('stream_index', 'Movie - Stream Index', ''),
+    ('mpeg_preseek', 'Movie - MPEG Preseek', ('mpeg_preseek',)),
+    ('stream_index', 'Movie - Stream Index', ('stream_index',)),
     # WIPE
-    ('wipe', 'Effect - Wipe', ''),
+    ('wipe', 'Effect - Wipe',
+        ('angle', 'blur_width', 'direction', 'transition_type')),
     # TRANSFORM
-    ('transform', 'Effect - Transform', ''),
+    ('transform', 'Effect - Transform',
+        ('interpolation', 'rotation_start', 'use_uniform_scale',
+        'scale_start_x', 'scale_start_y', 'translation_unit',
+        'translate_start_x', 'translate_start_y')),
     # COLOR
-    ('color', 'Effect - Color', ''),
+    ('color', 'Effect - Color', ('color',)),
     # SPEED
-    ('speed', 'Effect - Speed', ''),
+    ('speed', 'Effect - Speed',
+        ('use_default_fade', 'speed_factor', 'use_as_speed',
+        'scale_to_length', 'multiply_speed', 'use_frame_blend')),
     # MULTICAM
-    ('multicam_source', 'Effect - Multicam Source', ''),
+    ('multicam_source', 'Effect - Multicam Source', ('multicam_source',)),
     # EFFECT
-    ('effect_fader', 'Effect - Effect Fader', ''),
-    ],
+    ('effect_fader', 'Effect - Effect Fader',
+        ('use_default_fade', 'effect_fader')),
+    )
+
+copy_properties_items = [(i[0], i[1], '') for i in copy_properties_table]
+copy_properties_paths = dict((i[0], i[2]) for i in copy_properties_table)
+
+
+def resolve_path(strip, path):
+    '''
+    returns (owner, attribute) for a dotted rna path of the strip,
+    raises AttributeError if the strip does not have it
+    '''
+    owner = strip
+    names = path.split('.')
+    for name in names[:-1]:
+        owner = getattr(owner, name)
+    if not hasattr(owner, names[-1]):
+        raise AttributeError(path)
+    return owner, names[-1]
+
+
+def plain_value(value):
+    # rna arrays (colors...) are compared as tuples
+    if hasattr(value, '__len__') and not isinstance(value, str):
+        return tuple(value)
+    return value
+
+
+class Sequencer_Extra_CopyProperties(bpy.types.Operator):
+    bl_label = 'Copy Properties'
+    bl_idname = 'sequencerextra.copyproperties'
+    bl_description = 'Copy properties of active strip to selected strips'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    prop = EnumProperty(
+    name='Property',
+    items=copy_properties_items,
     default='blend_alpha')
 
+    props = EnumProperty(
+    name='Properties',
+    description='Copy several property groups at once, '\
+    'prop is used when empty',
+    items=copy_properties_items,
+    options={'ENUM_FLAG', 'SKIP_SAVE'},
+    default=set())
+
     @classmethod
     def poll(self, context):
         strip = functions.act_strip(context)
@@ -676,7 +693,6 @@ class Sequencer_Extra_CopyProperties(bpy.types.Operator):
 
     def execute(self, context):
         strip = functions.act_strip(context)
-        selectedstrips = context.selected_editable_sequences
 
         scn = context.scene
         seq = scn.sequence_editor
@@ -684,104 +700,37 @@ class Sequencer_Extra_CopyProperties(bpy.types.Operator):
         if meta_level > 0:
             seq = seq.meta_stack[meta_level - 1]
 
-        for i in seq.sequences:
-            if (i.select == True and not i.mute):
+        # read the values of the active strip once
+        groups = self.props or {self.prop}
+        values = []
+        for group, label, paths in copy_properties_table:
+            if group not in groups:
+                continue
+            for path in paths:
                 try:
-                    if self.prop == 'name':
-                        i.name = strip.name
-                    elif self.prop == 'blend_alpha':
-                        i.blend_alpha = strip.blend_alpha
-                    elif self.prop == 'blend_type':
-                        i.blend_type = strip.blend_type
-                    elif self.prop == 'animation_offset':
-                        i.animation_offset_start = strip.animation_offset_start
-                        i.animation_offset_end = strip.animation_offset_end
-                    elif self.prop == 'use_translation':
-                        i.use_translation = strip.use_translation
-                        i.transform.offset_x = strip.transform.offset_x
-                        i.transform.offset_y = strip.transform.offset_y
-                    elif self.prop == 'crop':
-                        i.use_crop = strip.use_crop
-                        i.crop.min_x = strip.crop.min_x
-                        i.crop.min_y = strip.crop.min_y
-                        i.crop.max_x = strip.crop.max_x
-                        i.crop.max_y = strip.crop.max_y
-                    elif self.prop == 'proxy':
-                        i.use_proxy = strip.use_proxy
-                        p = strip.proxy.use_proxy_custom_directory  # pep80
-                        i.proxy.use_proxy_custom_directory = p
-                        i.proxy.use_proxy_custom_file = strip.proxy.use_proxy_custom_file
-                        i.proxy.build_100 = strip.proxy.build_100
-                        i.proxy.build_25 = strip.proxy.build_25
-                        i.proxy.build_50 = strip.proxy.build_50
-                        i.proxy.build_75 = strip.proxy.build_75
-                        i.proxy.directory = strip.proxy.directory
-                        i.proxy.filepath = strip.proxy.filepath
-                        i.proxy.quality = strip.proxy.quality
-                        i.proxy.timecode = strip.proxy.timecode
-                        i.proxy.use_overwrite = strip.proxy.use_overwrite
-                    elif self.prop == 'strobe':
-                        i.strobe = strip.strobe
-                    elif self.prop == 'color_multiply':
-                        i.color_multiply = strip.color_multiply
-                    elif self.prop == 'color_saturation':
-                        i.color_saturation = strip.color_saturation
-                    elif self.prop == 'deinterlace':
-                        i.use_deinterlace = strip.use_deinterlace
-                    elif self.prop == 'flip':
-                        i.use_flip_x = strip.use_flip_x
-                        i.use_flip_y = strip.use_flip_y
-                    elif self.prop == 'float':
-                        i.use_float = strip.use_float
-                    elif self.prop == 'alpha_mode':
-                        i.alpha_mode = strip.alpha_mode
-                    elif self.prop == 'reverse':
-                        i.use_reverse_frames = strip.use_reverse_frames
-                    elif self.prop == 'pan':
-                        i.pan = strip.pan
-                    elif self.prop == 'pitch':
-                        i.pitch = strip.pitch
-                    elif self.prop == 'volume':
-                        i.volume = strip.volume
-                    elif self.prop == 'cache':
-                        i.use_memory_cache = strip.use_memory_cache
-                    elif self.prop == 'directory':
-                        i.directory = strip.directory
-                    elif self.prop == 'mpeg_preseek':
-                        i.mpeg_preseek = strip.mpeg_preseek
-                    elif self.prop == 'stream_index':
-                        i.stream_index = strip.stream_index
-                    elif self.prop == 'wipe':
-                        i.angle = strip.angle
-                        i.blur_width = strip.blur_width
-                        i.direction = strip.direction
-                        i.transition_type = strip.transition_type
-                    elif self.prop == 'transform':
-                        i.interpolation = strip.interpolation
-                        i.rotation_start = strip.rotation_start
-                        i.use_uniform_scale = strip.use_uniform_scale
-                        i.scale_start_x = strip.scale_start_x
-                        i.scale_start_y = strip.scale_start_y
-                        i.translation_unit = strip.translation_unit
-                        i.translate_start_x = strip.translate_start_x
-                        i.translate_start_y = strip.translate_start_y
-                    elif self.prop == 'color':
-                        i.color = strip.color
-                    elif self.prop == 'speed':
-                        i.use_default_fade = strip.use_default_fade
-                        i.speed_factor = strip.speed_factor
-                        i.use_as_speed = strip.use_as_speed
-                        i.scale_to_length = strip.scale_to_length
-                        i.multiply_speed = strip.multiply_speed
-                        i.use_frame_blend = strip.use_frame_blend
-                    elif self.prop == 'multicam_source':
-                        i.multicam_source = strip.multicam_source
-                    elif self.prop == 'effect_fader':
-                        i.use_default_fade = strip.use_default_fade
-                        i.effect_fader = strip.effect_fader
-                except:
+                    owner, name = resolve_path(strip, path)
+                    values.append((path, plain_value(getattr(owner, name))))
+                except AttributeError:
                     pass
 
+        # (strip type, path) pairs that cannot be copied
+        incompatible = set()
+        for i in seq.sequences:
+            if not i.select or i.mute or i == strip:
+                continue
+            for path, value in values:
+                key = (i.type, path)
+                if key in incompatible:
+                    continue
+                try:
+                    owner, name = resolve_path(i, path)
+                    # do not write values that do not change
+                    if plain_value(getattr(owner, name)) == value:
+                        continue
+                    setattr(owner, name, value)
+                except (AttributeError, TypeError, ValueError):
+                    incompatible.add(key)
+
         bpy.ops.sequencer.reload()
         return {'FINISHED'}
 
@@ -790,7 +739,7 @@ class Sequencer_Extra_CopyProperties(bpy.types.Operator):
 class Sequencer_Extra_FadeInOut(bpy.types.Operator):
     bl_idname = 'sequencerextra.fadeinout'
     bl_label = 'Fade...'
-    bl_description = 'Fade volume or opacity of active strip'
+    bl_description = 'Fade volume or opacity of selected strips'
     mode = EnumProperty(
             name='Direction',
             items=(
@@ -821,71 +770,48 @@ class Sequencer_Extra_FadeInOut(bpy.types.Operator):
         else:
             return False
 
+    def fade_keys(self, strip):
+        '''
+        returns the (frame, value) keyframes of the fade for the strip
+        '''
+        start = strip.frame_final_start
+        end = strip.frame_final_end
+        keys = []
+        if self.mode in {'IN', 'INOUT'}:
+            keys.append((start, 0.0))
+            keys.append((start + self.fade_duration, self.fade_amount))
+        if self.mode in {'OUT', 'INOUT'}:
+            keys.append((end - self.fade_duration, self.fade_amount))
+            keys.append((end, 0.0))
+        return keys
+
     def execute(self, context):
         seq = context.scene.sequence_editor
         scn = context.scene
-        strip = seq.active_strip
-        tmp_current_frame = context.scene.frame_current
-
-        if strip.type == 'SOUND':
-            if(self.mode) == 'OUT':
-                scn.frame_current = strip.frame_final_end - self.fade_duration
-                strip.volume = self.fade_amount
-                strip.keyframe_insert('volume')
-                scn.frame_current = strip.frame_final_end
-                strip.volume = 0
-                strip.keyframe_insert('volume')
-            elif(self.mode) == 'INOUT':
-                scn.frame_current = strip.frame_final_start
-                strip.volume = 0
-                strip.keyframe_insert('volume')
-                scn.frame_current += self.fade_duration
-                strip.volume = self.fade_amount
-                strip.keyframe_insert('volume')
-                scn.frame_current = strip.frame_final_end - self.fade_duration
-                strip.volume = self.fade_amount
-                strip.keyframe_insert('volume')
-                scn.frame_current = strip.frame_final_end
-                strip.volume = 0
-                strip.keyframe_insert('volume')
-            else:
-                scn.frame_current = strip.frame_final_start
-                strip.volume = 0
-                strip.keyframe_insert('volume')
-                scn.frame_current += self.fade_duration
-                strip.volume = self.fade_amount
-                strip.keyframe_insert('volume')
-
-        else:
-            if(self.mode) == 'OUT':
-                scn.frame_current = strip.frame_final_end - self.fade_duration
-                strip.blend_alpha = self.fade_amount
-                strip.keyframe_insert('blend_alpha')
-                scn.frame_current = strip.frame_final_end
-                strip.blend_alpha = 0
-                strip.keyframe_insert('blend_alpha')
-            elif(self.mode) == 'INOUT':
-                scn.frame_current = strip.frame_final_start
-                strip.blend_alpha = 0
-                strip.keyframe_insert('blend_alpha')
-                scn.frame_current += self.fade_duration
-                strip.blend_alpha = self.fade_amount
-                strip.keyframe_insert('blend_alpha')
-                scn.frame_current = strip.frame_final_end - self.fade_duration
-                strip.blend_alpha = self.fade_amount
-                strip.keyframe_insert('blend_alpha')
-                scn.frame_current = strip.frame_final_end
-                strip.blend_alpha = 0
-                strip.keyframe_insert('blend_alpha')
+        strips = context.selected_editable_sequences or [seq.active_strip]
+
+        # keyframes are written straight into the scene action, so the
+        # current frame never changes and no frame is evaluated
+        if scn.animation_data is None:
+            scn.animation_data_create()
+        action = scn.animation_data.action
+        if action is None:
+            action = bpy.data.actions.new(scn.name + "Action")
+            scn.animation_data.action = action
+
+        for strip in strips:
+            if strip.type == 'SOUND':
+                prop = 'volume'
             else:
-                scn.frame_current = strip.frame_final_start
-                strip.blend_alpha = 0
-                strip.keyframe_insert('blend_alpha')
-                scn.frame_current += self.fade_duration
-                strip.blend_alpha = self.fade_amount
-                strip.keyframe_insert('blend_alpha')
-
-        scn.frame_current = tmp_current_frame
+                prop = 'blend_alpha'
+            data_path = 'sequence_editor.sequences_all["{}"].{}'.format(
+                strip.name.replace('"', '\\"'), prop)
+            fcurve = action.fcurves.find(data_path)
+            if fcurve is None:
+                fcurve = action.fcurves.new(data_path)
+            for frame, value in self.fade_keys(strip):
+                fcurve.keyframe_points.insert(frame, value, {'FAST'})
+            fcurve.update()
 
         scn.kr_default_fade_duration = self.fade_duration
         scn.kr_default_fade_amount = self.fade_amount
@@ -920,17 +846,15 @@ class Sequencer_Extra_ExtendToFill(bpy.types.Operator):
         meta_level = len(seq.meta_stack)
         if meta_level > 0:
             seq = seq.meta_stack[meta_level - 1]
-            
+
+        index = StripIndex(seq.sequences)
         for strip in functions.get_selected_strips(context) or [functions.act_strip(context)]:
             chn = strip.channel
             stf = strip.frame_final_end
-            enf = 300000
+            enf = index.channel_next_start(chn, stf)
+            if enf is None:
+                enf = 300000
 
-            for i in seq.sequences:
-                ffs = i.frame_final_start
-                if (i.channel == chn and ffs > stf):
-                    if ffs < enf:
-                        enf = ffs
             if enf == 300000 and stf < scn.frame_end:
                 enf = scn.frame_end
 
@@ -1084,31 +1008,15 @@ class Sequencer_Extra_SelectCurrentFrame(bpy.types.Operator):
         if meta_level > 0:
             seq = seq.meta_stack[meta_level - 1]
 
+        index = StripIndex(seq.sequences, skip_muted=True)
         if mode == 'AFTER':
-            for i in seq.sequences:
-                try:
-                    if (i.frame_final_start >= cf
-                    and not i.mute):
-                        i.select = True
-                except AttributeError:
-                        pass
+            striplist = index.starting_from(cf)
         elif mode == 'ON':
-            for i in seq.sequences:
-                try:
-                    if (i.frame_final_start <= cf
-                    and i.frame_final_end > cf
-                    and not i.mute):
-                        i.select = True
-                except AttributeError:
-                        pass
+            striplist = index.covering(cf)
         else:
-            for i in seq.sequences:
-                try:
-                    if (i.frame_final_end < cf
-                    and not i.mute):
-                        i.select = True
-                except AttributeError:
-                        pass
+            striplist = index.ending_before(cf)
+        for i in striplist:
+            i.select = True
 
         return {'FINISHED'}
 
@@ -0,0 +1,163 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# content addressed proxy cache, shared by every blend file.
+# proxies are stored as <key>.avi, where key is computed from the
+# source identity (size, mtime and a hash of the first and last MiB),
+# the proxy size and the command template used to build it.
+# index.json keeps the size and last use of every entry, oldest
+# entries are removed when the cache grows over its byte budget.
+# entries used since the start of the current operator run, by this
+# or any other blender session, are never removed. Only files added
+# to the index once their job is done are cache hits, a file left at
+# a key path by an interrupted encode is not.
+
+import os
+import json
+import time
+import hashlib
+
+
+# bytes read from the start and the end of the source to identify it
+sample_size = 1024 * 1024
+
+
+def default_directory():
+    cache_home = os.environ.get("XDG_CACHE_HOME",
+        os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "kinoraw_tools", "proxies")
+
+
+def source_identity(filename):
+    '''
+    returns a string identifying the content of the file without
+    reading all of it: size, mtime and hash of the first and last MiB
+    '''
+    st = os.stat(filename)
+    sha = hashlib.sha1()
+    with open(filename, "rb") as f:
+        sha.update(f.read(sample_size))
+        if st.st_size > sample_size:
+            f.seek(max(sample_size, st.st_size - sample_size))
+            sha.update(f.read(sample_size))
+    return "{}:{}:{}".format(st.st_size, int(st.st_mtime), sha.hexdigest())
+
+
+def cache_key(identity, size, template):
+    '''
+    returns the key of a proxy, identity is the source_identity() of
+    its source, computed once for all the sizes
+    '''
+    text = "{}|{}|{}".format(identity, size, template)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ProxyCache(object):
+    '''
+    on disk cache of proxy files with LRU eviction
+    '''
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.json")
+        self.entries = self.read_index()
+        self.run_started = time.time()
+
+    def begin_run(self, keys=()):
+        '''
+        starts an operator run, entries looked up or added from now on
+        and the entries of keys (i.e. attached to strips) are kept
+        until the next run
+        '''
+        self.run_started = time.time()
+        for key in keys:
+            if key in self.entries:
+                self.entries[key]["used"] = self.run_started
+
+    def read_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def merge(self):
+        # merge with entries written meanwhile by other blender sessions
+        entries = self.read_index()
+        for key, entry in self.entries.items():
+            if key not in entries or entries[key]["used"] < entry["used"]:
+                entries[key] = entry
+        for key in list(entries):
+            if not os.path.isfile(self.path(key)):
+                del entries[key]
+        self.entries = entries
+
+    def save(self):
+        self.merge()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.index_path)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".avi")
+
+    def lookup(self, key):
+        '''
+        returns the path to the cached proxy, or None if not cached
+        '''
+        path = self.path(key)
+        if key not in self.entries:
+            # entries added meanwhile by other sessions or proxy_runner
+            self.merge()
+        if key not in self.entries or not os.path.isfile(path):
+            self.entries.pop(key, None)
+            return None
+        self.entries[key]["used"] = time.time()
+        return path
+
+    def add(self, key, source=""):
+        path = self.path(key)
+        if not os.path.isfile(path):
+            return
+        self.entries[key] = {"bytes": os.path.getsize(path),
+            "source": source, "used": time.time()}
+        self.merge()
+        self.evict()
+        self.save()
+
+    def total_bytes(self):
+        return sum(i["bytes"] for i in self.entries.values())
+
+    def evict(self):
+        total = self.total_bytes()
+        oldest = sorted(self.entries, key=lambda k: self.entries[k]["used"])
+        for key in oldest:
+            if total <= self.max_bytes:
+                break
+            if self.entries[key]["used"] >= self.run_started:
+                # in use by the current run
+                break
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+            total -= self.entries.pop(key)["bytes"]
@@ -0,0 +1,457 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# job queue for external transcoders (ffmpeg...)
+# this module does not import bpy, jobs are plain shell commands
+# and the scheduler is polled from a modal operator timer, so
+# blender never blocks waiting for a process to finish.
+# ffmpeg jobs run with -progress, two reader threads per job collect
+# the encoding stats and the end of stderr, see ProxyJob.stats().
+# jobs can also be written to a json manifest and run out of blender
+# with proxy_runner.py, see write_manifest().
+
+import os
+import json
+import time
+import signal
+import hashlib
+import threading
+import subprocess
+import multiprocessing
+from collections import deque
+
+
+# lines of stderr kept for every job
+stderr_lines = 20
+
+
+def cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def insert_args(command, args):
+    '''
+    adds args right after the program of an ffmpeg command,
+    other commands are returned unchanged
+    '''
+    parts = command.strip().split(" ", 1)
+    if len(parts) < 2:
+        return command
+    if not os.path.basename(parts[0]).startswith("ffmpeg"):
+        return command
+    return "{} {} {}".format(parts[0], args, parts[1])
+
+
+def progress_command(command):
+    '''
+    adds -progress to ffmpeg commands, so the encoding stats
+    are written to stdout as key=value lines
+    '''
+    if "-progress" in command:
+        return command
+    return insert_args(command, "-progress pipe:1 -nostats")
+
+
+def write_log(path, jobs):
+    '''
+    appends the stats of the jobs to a json lines file
+    '''
+    with open(path, "a") as f:
+        for job in jobs:
+            f.write(json.dumps(job.stats()) + "\n")
+
+
+manifest_version = 1
+
+
+def job_key(job):
+    '''
+    returns a string identifying the job in manifests and runner state
+    '''
+    return hashlib.sha1(job.command.encode("utf-8")).hexdigest()[:16]
+
+
+def read_manifest(path):
+    '''
+    returns the jobs of a json manifest, with their dependencies
+    '''
+    with open(path) as f:
+        manifest = json.load(f)
+    jobs = {}
+    entries = []
+    for entry in manifest.get("jobs", []):
+        if entry["id"] in jobs:
+            # the same command twice would run twice on the same outputs
+            continue
+        jobs[entry["id"]] = ProxyJob(entry["command"], entry.get("outputs", []),
+            strip_names=entry.get("strips", []), sizes=entry.get("sizes", []),
+            source=(entry.get("inputs") or [None])[0],
+            total_frames=entry.get("total_frames", 0),
+            kind=entry.get("kind", "proxy"))
+        cache = entry.get("cache")
+        if cache:
+            job = jobs[entry["id"]]
+            job.cache_dir = cache["dir"]
+            job.cache_bytes = cache["bytes"]
+            job.cache_keys = cache["keys"]
+        entries.append(entry)
+    for entry in entries:
+        jobs[entry["id"]].depends = [jobs[i] for i in entry.get("depends", [])]
+    return [jobs[entry["id"]] for entry in entries]
+
+
+def write_manifest(path, jobs):
+    '''
+    adds the jobs to a json manifest, replacing the jobs of the
+    manifest writing the same outputs. jobs must come after the
+    jobs they depend on
+    '''
+    try:
+        old = read_manifest(path)
+    except (IOError, OSError, ValueError, KeyError):
+        old = []
+    outputs = set(o for job in jobs for o in job.outputs)
+    # keep old jobs not replaced, and the jobs they depend on
+    kept = [job for job in old if not outputs.intersection(job.outputs)]
+    for job in list(kept):
+        for dep in job.depends:
+            if dep not in kept:
+                kept.append(dep)
+    kept = [job for job in old if job in kept]
+
+    entries = []
+    ids = {}
+    for job in kept + list(jobs):
+        ids[job] = job_key(job)
+        if ids[job] in [entry["id"] for entry in entries]:
+            continue
+        entries.append({
+            "id": ids[job],
+            "kind": job.kind,
+            "command": job.command,
+            "inputs": [job.source] if job.source else [],
+            "outputs": job.outputs,
+            "strips": job.strip_names,
+            "sizes": job.sizes,
+            "total_frames": job.total_frames,
+            "depends": [ids[dep] for dep in job.depends],
+            "cache": {"dir": job.cache_dir, "bytes": job.cache_bytes,
+                "keys": job.cache_keys} if job.cache_dir else None,
+            })
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"version": manifest_version, "created": time.time(),
+            "jobs": entries}, f, indent=1)
+    os.replace(tmp, path)
+
+
+def default_max_jobs(threads_per_job=1):
+    '''
+    returns how many jobs fit in this machine: number of cores
+    divided by the threads used by every job
+    '''
+    return max(1, cpu_count() // max(1, threads_per_job))
+
+
+class ProxyJob(object):
+    '''
+    an external command that writes one or more output files.
+    sizes, strip_names, source and cache_keys are only used by the
+    caller to know what to do with the outputs once the job is finished,
+    cache_dir and cache_bytes tell proxy_runner.py which cache to add
+    the cache_keys to.
+    total_frames is the expected number of frames, used for the
+    remaining time. The job is started only once all the jobs
+    in depends are done, and fails if any of them fails
+    '''
+
+    def __init__(self, command, outputs, strip_names=(), sizes=(),
+        source=None, total_frames=0, depends=(), kind="proxy"):
+        self.command = command
+        self.kind = kind
+        self.attempts = 0
+        self.depends = list(depends)
+        # queued jobs with lower priority run first
+        self.priority = 0
+        self.outputs = list(outputs)
+        # every strip using the outputs, strips cut from the same
+        # source share one job
+        self.strip_names = list(strip_names)
+        self.sizes = list(sizes)
+        self.source = source
+        self.total_frames = total_frames
+        self.cache_keys = []
+        self.cache_dir = None
+        self.cache_bytes = 0
+        self.status = 'QUEUED'
+        self.returncode = None
+        self.process = None
+
+        # stats, updated by the reader threads while running
+        self.started = None
+        self.ended = None
+        self.frames = 0
+        self.fps = 0.0
+        self.out_bytes = 0
+        self.stderr_tail = deque(maxlen=stderr_lines)
+        self.readers = []
+
+    def is_ready(self):
+        return all(job.status == 'DONE' for job in self.depends)
+
+    def is_blocked(self):
+        return any(job.status in {'FAILED', 'CANCELLED'}
+            for job in self.depends)
+
+    def reset(self):
+        '''
+        puts a finished job back in the queued state
+        '''
+        self.status = 'QUEUED'
+        self.returncode = None
+        self.process = None
+        self.started = None
+        self.ended = None
+        self.frames = 0
+        self.fps = 0.0
+
+    def start(self):
+        self.attempts += 1
+        self.started = time.time()
+        # own process group, so kill() stops the shell and its children
+        self.process = subprocess.Popen(progress_command(self.command),
+            shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, start_new_session=True)
+        self.readers = [
+            threading.Thread(target=self.read_progress,
+                args=(self.process.stdout,)),
+            threading.Thread(target=self.read_stderr,
+                args=(self.process.stderr,))]
+        for reader in self.readers:
+            reader.daemon = True
+            reader.start()
+        self.status = 'RUNNING'
+
+    def read_progress(self, stream):
+        for line in stream:
+            key, sep, value = line.decode("utf-8", "replace").strip().\
+                partition("=")
+            try:
+                if key == "frame":
+                    self.frames = int(value)
+                elif key == "fps":
+                    self.fps = float(value)
+                elif key == "total_size":
+                    self.out_bytes = int(value)
+            except ValueError:
+                # N/A values at the start of the encode
+                pass
+        stream.close()
+
+    def read_stderr(self, stream):
+        for line in stream:
+            self.stderr_tail.append(line.decode("utf-8", "replace").rstrip())
+        stream.close()
+
+    def end(self):
+        self.ended = time.time()
+        for reader in self.readers:
+            reader.join(1.0)
+        self.readers = []
+        sizes = [os.path.getsize(i) for i in self.outputs if os.path.isfile(i)]
+        if sizes:
+            self.out_bytes = sum(sizes)
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.ended or time.time()) - self.started
+
+    def remaining(self):
+        '''
+        returns the estimated seconds left, or None if unknown
+        '''
+        if self.fps <= 0 or self.total_frames <= self.frames:
+            return None
+        return (self.total_frames - self.frames) / self.fps
+
+    def stats(self):
+        elapsed = self.elapsed()
+        return {
+            "strips": self.strip_names,
+            "source": self.source,
+            "sizes": self.sizes,
+            "outputs": self.outputs,
+            "command": self.command,
+            "status": self.status,
+            "returncode": self.returncode,
+            "started": self.started,
+            "ended": self.ended,
+            "elapsed": round(elapsed, 3),
+            "frames": self.frames,
+            "total_frames": self.total_frames,
+            "fps": round(self.frames / elapsed, 2) if elapsed else 0.0,
+            "out_bytes": self.out_bytes,
+            "stderr_tail": list(self.stderr_tail),
+            }
+
+    def poll(self):
+        '''
+        returns True once the process has finished
+        '''
+        if self.process is None:
+            return self.status not in {'QUEUED', 'RUNNING'}
+        returncode = self.process.poll()
+        if returncode is None:
+            return False
+        self.returncode = returncode
+        self.process = None
+        self.end()
+        if returncode == 0:
+            self.status = 'DONE'
+        else:
+            self.status = 'FAILED'
+            self.remove_outputs()
+        return True
+
+    def kill(self):
+        if self.process is not None:
+            try:
+                if hasattr(os, "killpg"):
+                    os.killpg(self.process.pid, signal.SIGKILL)
+                else:
+                    self.process.kill()
+                self.process.wait()
+            except OSError:
+                pass
+            self.process = None
+            self.end()
+            self.remove_outputs()
+        self.status = 'CANCELLED'
+
+    def remove_outputs(self):
+        '''
+        removes the outputs of a job that did not finish, they may be
+        partially written and would be taken as valid files later
+        '''
+        for output in self.outputs:
+            try:
+                os.remove(output)
+            except OSError:
+                pass
+
+
+class JobScheduler(object):
+    '''
+    runs queued jobs with at most max_jobs processes at a time.
+    call poll() periodically, it starts new jobs when there are
+    free slots and returns the jobs finished since the last call.
+    queued jobs waiting for other jobs are skipped until those are done,
+    the others are started in priority order, see reprioritize()
+    '''
+
+    def __init__(self, max_jobs=None, retries=0):
+        self.max_jobs = max_jobs or default_max_jobs()
+        # times a failed job is started again before giving up
+        self.retries = retries
+        self.queued = deque()
+        self.running = []
+        self.finished = []
+
+    def add(self, job):
+        self.queued.append(job)
+
+    def reprioritize(self, priority):
+        '''
+        sets the priority of every queued job to priority(job) and sorts
+        the queue, jobs with the same priority keep their order
+        '''
+        for job in self.queued:
+            job.priority = priority(job)
+        self.queued = deque(sorted(self.queued, key=lambda j: j.priority))
+
+    def poll(self):
+        done = []
+        for job in list(self.running):
+            if job.poll():
+                self.running.remove(job)
+                if job.status == 'FAILED' and job.attempts <= self.retries:
+                    job.reset()
+                    self.queued.appendleft(job)
+                    continue
+                self.finished.append(job)
+                done.append(job)
+
+        for job in list(self.queued):
+            if job.is_blocked():
+                self.queued.remove(job)
+                job.status = 'FAILED'
+                job.stderr_tail.append("a job it depends on failed")
+                self.finished.append(job)
+                done.append(job)
+
+        while len(self.running) < self.max_jobs:
+            job = next((j for j in self.queued if j.is_ready()), None)
+            if job is None:
+                break
+            self.queued.remove(job)
+            try:
+                job.start()
+            except OSError as e:
+                job.status = 'FAILED'
+                job.stderr_tail.append(str(e))
+                job.ended = time.time()
+                self.finished.append(job)
+                done.append(job)
+                continue
+            self.running.append(job)
+
+        return done
+
+    def cancel(self):
+        for job in self.running:
+            job.kill()
+            self.finished.append(job)
+        for job in self.queued:
+            job.status = 'CANCELLED'
+            self.finished.append(job)
+        self.running = []
+        self.queued.clear()
+
+    @property
+    def total(self):
+        return len(self.queued) + len(self.running) + len(self.finished)
+
+    @property
+    def is_done(self):
+        return not self.queued and not self.running
+
+    def progress(self):
+        if not self.total:
+            return 1.0
+        return len(self.finished) / self.total
+
+    def count(self, status):
+        return len([j for j in self.finished if j.status == status])
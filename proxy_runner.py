@@ -0,0 +1,184 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# proxy job runner, not part of the addon modules.
+# with "generate scripts" on, the proxy and audio operators add their
+# ffmpeg jobs to a jobs.json manifest instead of running them, then
+#   python3 proxy_runner.py proxy_scripts/jobs.json -j 8
+# runs the jobs with the addon scheduler, pieces of a proxy before the
+# job joining them. Finished jobs are recorded in jobs.json.state, so a
+# run stopped halfway starts again where it was, and jobs whose outputs
+# already exist with the expected length are skipped. Proxies written to
+# the proxy cache are added to its index once their job is done.
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import proxy_jobs
+import proxy_cache
+
+
+def output_frames(filename):
+    '''
+    returns the frame count of filename read with ffprobe, or None
+    '''
+    command = ["ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-count_packets", "-show_entries", "stream=nb_read_packets",
+        "-of", "csv=p=0", filename]
+    try:
+        out = subprocess.check_output(command, stderr=subprocess.DEVNULL)
+        return int(out.decode("utf-8").strip().splitlines()[0])
+    except (OSError, subprocess.CalledProcessError, ValueError, IndexError):
+        return None
+
+
+def outputs_valid(job):
+    '''
+    true if every output of job exists and is not empty, proxies must
+    also have the frame count of the source when ffprobe can read it
+    '''
+    for output in job.outputs:
+        if not os.path.isfile(output) or not os.path.getsize(output):
+            return False
+        if job.kind == "proxy" and job.total_frames:
+            frames = output_frames(output)
+            if frames is not None and frames != job.total_frames:
+                return False
+    return True
+
+
+def read_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def write_state(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, path)
+
+
+def add_to_cache(job):
+    if job.status != 'DONE' or not job.cache_dir:
+        return
+    cache = proxy_cache.ProxyCache(job.cache_dir, job.cache_bytes)
+    for key in job.cache_keys:
+        if key is not None:
+            cache.add(key, job.source or "")
+
+
+def skipped_jobs(jobs, state, force):
+    '''
+    returns the jobs with nothing left to do: done in a previous run
+    with their outputs still there, or with valid outputs. Jobs only
+    needed by skipped jobs are skipped too
+    '''
+    skipped = set()
+    if force:
+        return skipped
+    for job in jobs:
+        if state.get(proxy_jobs.job_key(job)) == 'DONE' and \
+            all(os.path.isfile(i) for i in job.outputs):
+            skipped.add(job)
+        elif job.outputs and outputs_valid(job):
+            skipped.add(job)
+
+    needed = {}
+    for job in jobs:
+        for dep in job.depends:
+            needed.setdefault(dep, []).append(job)
+    # dependents come after their dependencies in the manifest
+    for job in reversed(jobs):
+        if job in needed and all(i in skipped for i in needed[job]):
+            skipped.add(job)
+    return skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="run the jobs of a kinoraw tools jobs.json manifest")
+    parser.add_argument("manifest")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+        help="jobs running at once, default from the cpu count")
+    parser.add_argument("--retries", type=int, default=1,
+        help="times a failed job is started again")
+    parser.add_argument("--force", action="store_true",
+        help="run all the jobs, even the finished ones")
+    parser.add_argument("--log", help="append the job stats to this file")
+    args = parser.parse_args(argv)
+
+    jobs = proxy_jobs.read_manifest(args.manifest)
+    state_path = args.manifest + ".state"
+    state = read_state(state_path)
+    skipped = skipped_jobs(jobs, state, args.force)
+
+    scheduler = proxy_jobs.JobScheduler(args.jobs or None, args.retries)
+    for job in jobs:
+        if job in skipped:
+            # lets the jobs depending on it start
+            job.status = 'DONE'
+        else:
+            for output in job.outputs:
+                directory = os.path.dirname(output)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+            scheduler.add(job)
+    print("{} jobs, {} skipped, {} at once".format(len(jobs), len(skipped),
+        scheduler.max_jobs))
+
+    started = time.time()
+    try:
+        while not scheduler.is_done:
+            for job in scheduler.poll():
+                state[proxy_jobs.job_key(job)] = job.status
+                write_state(state_path, state)
+                add_to_cache(job)
+                print("[{}/{}] {} {} {} in {:.1f}s".format(
+                    scheduler.count('DONE') + scheduler.count('FAILED'),
+                    scheduler.total, job.status.lower(), job.kind,
+                    ", ".join(job.strip_names) or job.outputs[0],
+                    job.elapsed()))
+                if job.status == 'FAILED':
+                    for line in job.stderr_tail:
+                        print("    " + line)
+                if args.log:
+                    proxy_jobs.write_log(args.log, [job])
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        scheduler.cancel()
+        print("cancelled, run again to resume")
+        return 130
+
+    failed = scheduler.count('FAILED')
+    print("finished in {:.1f}s, {} failed".format(time.time() - started,
+        failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,14 @@
 import bpy, os
 from bpy.props import IntProperty, StringProperty, BoolProperty
-import subprocess
+import shlex
+import hashlib
+from bisect import bisect_left
+from bpy.app.handlers import persistent
 
 from . import functions
+from . import metadata
+from . import proxy_jobs
+from . import proxy_cache
 
 
 proxy_qualities = [  ( "1", "25%", "" ), ( "2", "50%", "" ),
@@ -32,6 +38,14 @@ def setup_proxy(context, strip, size):
     strip.proxy.quality = prefs.quality
     strip.proxy.timecode = prefs.timecode
 
+    # build the index of the timecode in use
+    if prefs.timecode in {"RECORD_RUN", "RECORD_RUN_NO_GAPS"}:
+        strip.proxy.build_record_run = True
+    elif prefs.timecode == "FREE_RUN":
+        strip.proxy.build_free_run = True
+    elif prefs.timecode == "FREE_RUN_REC_DATE":
+        strip.proxy.build_free_run_rec_date = True
+
     if size == 5:
         strip.use_proxy = False
         strip.proxy.build_25 = False
@@ -55,74 +69,526 @@ def setup_proxy(context, strip, size):
     return {"FINISHED"}
 
 
-def create_proxy(context, strip, size, res):
+def requested_sizes(prefs, size):
+    '''
+    returns the list of proxy sizes (1 to 4) to build, size 0 means
+    every size checked in the proxy tools panel
+    '''
+    if size != 0:
+        return [size]
+    sizes = []
+    for i, build in enumerate((prefs.proxy_build_25, prefs.proxy_build_50,
+        prefs.proxy_build_75, prefs.proxy_build_100)):
+        if build:
+            sizes.append(i+1)
+    return sizes
+
+
+def strip_resolutions(context, strips):
+    '''
+    returns the resolution of every movie strip source as a (x, y) tuple,
+    or the scene resolution if exiftool cannot tell. Cached metadata
+    is used when available, the rest is read by the exiftool pool
+    '''
+    sce = context.scene
+    default = (sce.render.resolution_x, sce.render.resolution_y)
+    filenames = [bpy.path.abspath(strip.filepath) for strip in strips]
+    try:
+        data = metadata.read_metadata(filenames)
+    except (OSError, ValueError):
+        return [default for strip in strips]
+
+    resolutions = []
+    for d in data:
+        try:
+            res = str(d['Composite:ImageSize']).replace(" ", "x").split("x")
+            resolutions.append((int(res[0]), int(res[1])))
+        except (ValueError, KeyError, IndexError):
+            resolutions.append(default)
+    return resolutions
+
+
+def proxy_output(proxy_dir, filename, size):
+    proxysuffix = proxy_qualities[size-1][1].split("%")[0]
+    newfilename = os.path.join(bpy.path.abspath(proxy_dir),
+        filename.rpartition("/")[2])
+    return newfilename.rpartition(".")[0]+"-"+proxysuffix+".avi"
+
+
+def proxy_command(ffmpeg_command, filename, size, res, fileoutput):
     # calculate proxy resolution
     div = 4/size
     newres = (int(int(res[0])/div), int(int(res[1])/div))
 
+    #default value for ffmpeg_command = "fmpeg -i {} -vcodec mjpeg -qv 1 -s {}x{} -y {}"
+    return ffmpeg_command.format(shlex.quote(filename), newres[0], newres[1],
+        shlex.quote(fileoutput))
+
+
+def proxy_multi_command(output_args, filename, sizes, res, fileoutputs):
+    '''
+    returns a single ffmpeg command that decodes the source once and
+    writes one output for every size, using a split filter graph
+    '''
+    graph = ["[0:v]split={}{}".format(len(sizes),
+        "".join("[s{}]".format(i) for i in range(len(sizes))))]
+    outputs = []
+    for i, size in enumerate(sizes):
+        div = 4/size
+        newres = (int(int(res[0])/div), int(int(res[1])/div))
+        graph.append("[s{}]scale={}:{}[o{}]".format(i, newres[0], newres[1], i))
+        outputs.append("-map '[o{}]' {} -y {}".format(i, output_args,
+            shlex.quote(fileoutputs[i])))
+    return "ffmpeg -i {} -filter_complex '{}' {}".format(shlex.quote(filename),
+        ";".join(graph), " ".join(outputs))
+
+
+# a proxy can be built from pieces encoded in parallel and joined at
+# the end. pieces are (start, duration, frames, from_source) tuples, in
+# seconds of the source. duration None means up to the end of the
+# source, and pieces not from_source are black frames keeping the
+# proxy frames aligned with the source frames.
+
+def segment_ranges(keyframes, frames, fps, count):
+    '''
+    returns count pieces covering the whole source, every one
+    starting at a keyframe
+    '''
+    duration = frames / fps
+    bounds = [0.0]
+    for i in range(1, count):
+        target = duration * i / count
+        k = bisect_left(keyframes, target)
+        near = keyframes[max(0, k-1):k+1]
+        if not near:
+            continue
+        t = min(near, key=lambda t: abs(t - target))
+        if t > bounds[-1] + 1.0 / fps and t < duration - 1.0 / fps:
+            bounds.append(t)
+
+    ranges = []
+    for a, b in zip(bounds, bounds[1:]):
+        # stop half a frame before the next keyframe
+        ranges.append((a, b - a - 0.5 / fps,
+            int(round(b * fps)) - int(round(a * fps)), True))
+    ranges.append((bounds[-1], None, frames - int(round(bounds[-1] * fps)),
+        True))
+    return ranges
+
+
+def source_frames(strip):
+    '''
+    returns the frame count of the whole source of a movie strip,
+    frame_duration leaves out the frames cut with trim duration
+    '''
+    return strip.frame_duration + strip.animation_offset_start + \
+        strip.animation_offset_end
+
+
+def used_ranges(context, strip, handles):
+    '''
+    returns the merged (first, end) source frames shown by all the
+    strips of the scene using the same file as strip, plus handles
+    '''
+    filename = bpy.path.abspath(strip.filepath)
+    total = source_frames(strip)
+    ranges = []
+    for i in context.scene.sequence_editor.sequences_all:
+        if i.type != 'MOVIE' or bpy.path.abspath(i.filepath) != filename:
+            continue
+        first = i.animation_offset_start + i.frame_offset_start
+        ranges.append((max(0, first - handles),
+            min(total, first + i.frame_final_duration + handles)))
+    ranges.sort()
+    merged = []
+    for first, end in ranges:
+        if merged and first <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((first, end))
+    return merged
+
+
+def range_pieces(ranges, frames, fps):
+    '''
+    returns the pieces of a proxy encoding only the source frame
+    ranges, with black frames in between
+    '''
+    pieces = []
+    position = 0
+    for first, end in ranges:
+        if first > position:
+            pieces.append((position / fps, (first - position - 0.5) / fps,
+                first - position, False))
+        pieces.append((first / fps, (end - first - 0.5) / fps, end - first,
+            True))
+        position = end
+    if position < frames:
+        pieces.append((position / fps, (frames - position - 0.5) / fps,
+            frames - position, False))
+    return pieces
+
+
+def strip_plans(context, strips):
+    '''
+    returns (pieces, fps, variant) for every strip built from pieces,
+    or None for the strips encoded in a single job. variant tells
+    proxies of part of the source from complete ones. Sources are
+    probed in parallel with ffprobe. The plan only depends on the
+    source file, pass one strip per file
+    '''
+    prefs = context.user_preferences.addons[__package__].preferences
+    plans = [None for strip in strips]
+    if not prefs.proxy_used_range and prefs.proxy_segments < 2:
+        return plans
+    filenames = [bpy.path.abspath(strip.filepath) for strip in strips]
+    probes = metadata.probe_media_files(filenames)
+
+    if prefs.proxy_used_range:
+        for i, (strip, probe) in enumerate(zip(strips, probes)):
+            if not probe:
+                continue
+            ranges = used_ranges(context, strip, prefs.proxy_handles)
+            if ranges == [(0, source_frames(strip))]:
+                continue
+            variant = "part-" + hashlib.sha1(str(ranges).encode(
+                "utf-8")).hexdigest()[:8]
+            plans[i] = (range_pieces(ranges, source_frames(strip),
+                probe["fps"]), probe["fps"], variant)
+        return plans
+
+    longs = [i for i, probe in enumerate(probes) if probe and
+        probe["frames"] / probe["fps"] >= prefs.proxy_segment_min_length]
+    keyframes = metadata.probe_media_files([filenames[i] for i in longs],
+        probe=metadata.probe_keyframes)
+    for i, k in zip(longs, keyframes):
+        if k:
+            plans[i] = (segment_ranges(k, probes[i]["frames"],
+                probes[i]["fps"], prefs.proxy_segments), probes[i]["fps"], "")
+    return plans
+
+
+def concat_list_entry(filename):
+    # quoting of the ffmpeg concat demuxer
+    return "file '{}'\n".format(filename.replace("'", "'\\''"))
+
+
+def piece_jobs(strips, filename, pieces, fps, res, command, sizes,
+    fileoutputs):
+    '''
+    returns the jobs encoding every piece with command (a function of
+    the input and the output files) and the job joining the pieces
+    into fileoutputs without encoding again, which runs the last
+    '''
+    segments_dir = fileoutputs[0] + ".segments"
+    if not os.path.isdir(segments_dir):
+        os.makedirs(segments_dir)
+
+    jobs = []
+    parts = [[] for i in fileoutputs]
+    for n, (start, duration, frames, from_source) in enumerate(pieces):
+        outputs = [os.path.join(segments_dir, "{:04d}-{}.avi".format(n, i))
+            for i in range(len(fileoutputs))]
+        if from_source:
+            args = "-ss {:.6f}".format(start)
+            if duration is not None:
+                args += " -t {:.6f}".format(duration)
+            piece_command = proxy_jobs.insert_args(command(filename, outputs),
+                args)
+        else:
+            black = "color=c=black:s={}x{}:r={:.6f}:d={:.6f}".format(
+                res[0], res[1], fps, duration)
+            piece_command = proxy_jobs.insert_args(command(black, outputs),
+                "-f lavfi")
+        job = proxy_jobs.ProxyJob(piece_command, outputs,
+            strip_names=[i.name for i in strips], source=filename,
+            total_frames=frames)
+        jobs.append(job)
+        for part, output in zip(parts, outputs):
+            part.append(output)
+
+    commands = []
+    for i, (part, fileoutput) in enumerate(zip(parts, fileoutputs)):
+        listfile = os.path.join(segments_dir, "list-{}.txt".format(i))
+        with open(listfile, "w") as f:
+            for output in part:
+                f.write(concat_list_entry(output))
+        commands.append("ffmpeg -f concat -safe 0 -i {} -c copy -y {}".format(
+            shlex.quote(listfile), shlex.quote(fileoutput)))
+    commands.append("rm -r {}".format(shlex.quote(segments_dir)))
+    jobs.append(proxy_jobs.ProxyJob(" && ".join(commands), fileoutputs,
+        strip_names=[i.name for i in strips], sizes=sizes, source=filename,
+        total_frames=source_frames(strips[0]), depends=list(jobs)))
+    return jobs
+
+
+def attached_size(sizes):
+    '''
+    returns the size attached to the strips when several sizes are
+    built: a strip has a single custom proxy file, the smallest is the
+    fastest to edit with. The other files stay in the proxy folder (or
+    cache), building that size again attaches them without encoding
+    '''
+    return min(sizes)
+
+
+def attach_proxy(strip, size, fileoutput):
+    # set up proxy settings, the custom file is used for one size only
+    proxysuffix = proxy_qualities[size-1][1].split("%")[0]
+    strip.use_proxy = True
+    strip.use_proxy_custom_file = True
+    strip.proxy.filepath = bpy.path.relpath(fileoutput)
+    strip.proxy.build_25 = proxysuffix == "25"
+    strip.proxy.build_50 = proxysuffix == "50"
+    strip.proxy.build_75 = proxysuffix == "75"
+    strip.proxy.build_100 = proxysuffix == "100"
+
+
+# proxy cache shared by every blend file, see proxy_cache.py
+_proxy_cache = None
+
+
+def get_proxy_cache(prefs):
+    '''
+    returns the proxy cache set in the preferences, or None if the
+    cache is disabled
+    '''
+    global _proxy_cache
+
+    if not prefs.use_proxy_cache:
+        return None
+    directory = bpy.path.abspath(prefs.proxy_cache_dir) or \
+        proxy_cache.default_directory()
+    max_bytes = prefs.proxy_cache_size * 1024 * 1024 * 1024
+    if _proxy_cache is None or _proxy_cache.directory != directory:
+        _proxy_cache = proxy_cache.ProxyCache(directory, max_bytes)
+    _proxy_cache.max_bytes = max_bytes
+    return _proxy_cache
+
+
+def source_groups(strips):
+    '''
+    returns the strips grouped by source file, so strips cut from the
+    same take share the plan and the jobs building their proxy instead
+    of writing the same files at once
+    '''
+    groups = {}
+    order = []
+    for strip in strips:
+        key = os.path.normpath(bpy.path.abspath(strip.filepath))
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(strip)
+    return [groups[key] for key in order]
+
+
+def attached_cache_keys(cache):
+    '''
+    returns the cache keys of the proxies attached to the strips of
+    every scene of the blend file
+    '''
+    keys = []
+    for scene in bpy.data.scenes:
+        if scene.sequence_editor is None:
+            continue
+        for strip in scene.sequence_editor.sequences_all:
+            if strip.type != 'MOVIE' or not strip.use_proxy_custom_file:
+                continue
+            path = os.path.abspath(bpy.path.abspath(strip.proxy.filepath))
+            if os.path.dirname(path) == os.path.abspath(cache.directory):
+                keys.append(os.path.basename(path).rpartition(".")[0])
+    return keys
+
+
+def create_proxy(context, strips, sizes, res, plan=None):
+    '''
+    returns a list of jobs needed to build the requested proxy sizes
+    for the strips, which all use the same source file. Proxies that
+    already exist are attached right away. with a plan from
+    strip_plans(), the proxy is built from pieces encoded in parallel
+    and joined at the end
+    '''
     preferences = context.user_preferences
-    proxy_dir = preferences.addons[__package__].preferences.proxy_dir
-    scripts = preferences.addons[__package__].preferences.proxy_scripts
-    ffmpeg_command = preferences.addons[__package__].preferences.ffmpeg_command
+    prefs = preferences.addons[__package__].preferences
+    proxy_dir = prefs.proxy_dir
 
     functions.create_folder(proxy_dir)
 
-    if scripts:
-        commands = []
+    jobs = []
+    strips = [strip for strip in strips if strip.type == "MOVIE"]
+    if not strips:
+        return jobs
 
     # get filename
-    if strip.type == "MOVIE":
-        filename = bpy.path.abspath(strip.filepath)
-        proxysuffix = proxy_qualities[size-1][1].split("%")[0]
-        proxy_dir = bpy.path.abspath(proxy_dir)
-        newfilename = os.path.join(proxy_dir,filename.rpartition("/")[2])
-        fileoutput = newfilename.rpartition(".")[0]+"-"+proxysuffix+".avi"
+    filename = bpy.path.abspath(strips[0].filepath)
+
+    single_decode = prefs.proxy_single_decode and len(sizes) > 1
+    if single_decode:
+        template = prefs.ffmpeg_output_args
+    else:
+        template = prefs.ffmpeg_command
+    variant = plan[2] if plan else ""
+    if variant:
+        template += "|" + variant
+    cache = get_proxy_cache(prefs)
+    identity = None
+    if cache is not None:
+        try:
+            identity = proxy_cache.source_identity(filename)
+        except (IOError, OSError):
+            pass
+
+    attach_size = attached_size(sizes)
+    missing = []
+    for size in sizes:
+        key = None
+        if identity is not None:
+            key = proxy_cache.cache_key(identity, size, template)
+        if key is not None:
+            fileoutput = cache.lookup(key) or cache.path(key)
+        else:
+            fileoutput = proxy_output(proxy_dir, filename, size)
+            if variant:
+                fileoutput = fileoutput.rpartition(".")[0] + "-" + \
+                    variant + ".avi"
+
+        # check for existing file
+        if os.path.isfile(fileoutput) and not prefs.proxy_scripts:
+            print("ya existe")
+            if size == attach_size:
+                for strip in strips:
+                    attach_proxy(strip, size, fileoutput)
+        else:
+            missing.append((size, fileoutput, key))
+
+    if cache is not None:
+        cache.save()
 
-        #default value for ffmpeg_command = "fmpeg -i {} -vcodec mjpeg -qv 1 -s {}x{} -y {}"
+    if single_decode and missing:
+        # decode the source only once for all the sizes
+        builds = [([i[0] for i in missing], [i[1] for i in missing],
+            [i[2] for i in missing])]
+    else:
+        builds = [([size], [fileoutput], [key])
+            for size, fileoutput, key in missing]
 
-        command = ffmpeg_command.format(filename, newres[0], newres[1], fileoutput)
-        print(command)
+    for build_sizes, fileoutputs, keys in builds:
+        if single_decode:
+            command = lambda source, outputs: proxy_multi_command(
+                prefs.ffmpeg_output_args, source, build_sizes, res, outputs)
+        else:
+            command = lambda source, outputs: proxy_command(
+                prefs.ffmpeg_command, source, build_sizes[0], res, outputs[0])
 
-        if scripts:
-            commands.append(command)
+        if plan:
+            build_jobs = piece_jobs(strips, filename, plan[0], plan[1], res,
+                command, build_sizes, fileoutputs)
         else:
-            # check for existing file
-            if not os.path.isfile(fileoutput):
-                subprocess.call(command, shell=True)
-            else:
-                print("ya existe")
+            build_jobs = [proxy_jobs.ProxyJob(command(filename, fileoutputs),
+                fileoutputs, strip_names=[strip.name for strip in strips],
+                sizes=build_sizes, source=filename,
+                total_frames=source_frames(strips[0]))]
+        for job in build_jobs:
+            print(job.command)
+        # the proxies are ready when the last job is done
+        build_jobs[-1].cache_keys = keys
+        if cache is not None:
+            build_jobs[-1].cache_dir = cache.directory
+            build_jobs[-1].cache_bytes = cache.max_bytes
+        jobs.extend(build_jobs)
+
+        if prefs.proxy_scripts:
+            # the jobs run out of blender, set up the strips now to use
+            # the proxies they will write
+            for size, fileoutput in zip(build_sizes, fileoutputs):
+                if size == attach_size:
+                    for strip in strips:
+                        attach_proxy(strip, size, fileoutput)
+
+    return jobs
+
+
+def manifest_path(scripts_dir):
+    return os.path.join(bpy.path.abspath(scripts_dir), "jobs.json")
+
+
+def create_proxy_scripts(scripts_dir, jobs):
+    '''
+    adds the jobs to the manifest of scripts_dir, to be run out of
+    blender with proxy_runner.py. returns the manifest path
+    '''
+    path = manifest_path(scripts_dir)
+    proxy_jobs.write_manifest(path, jobs)
+    return path
+
+
+def sequencer_view_range(context):
+    '''
+    returns the (first, last) frames shown in the first sequencer
+    area, or None if there is none
+    '''
+    for area in context.screen.areas:
+        if area.type != 'SEQUENCE_EDITOR':
+            continue
+        for region in area.regions:
+            if region.type == 'WINDOW':
+                first = region.view2d.region_to_view(0, 0)[0]
+                last = region.view2d.region_to_view(region.width, 0)[0]
+                return first, last
+    return None
+
+
+def job_priority(sequences, frame, view):
+    '''
+    returns a function giving the priority of a job: strips shown in
+    the sequencer first, then by distance to the current frame
+    '''
+    def strip_priority(strip):
+        start = strip.frame_final_start
+        end = strip.frame_final_end
+        if start <= frame < end:
+            distance = 0
+        else:
+            distance = min(abs(start - frame), abs(end - 1 - frame))
+        visible = view is not None and start < view[1] and end > view[0]
+        return (0 if visible else 1, distance)
 
-        # set up proxy settings
-        strip.use_proxy = True
-        strip.use_proxy_custom_file = True
-        strip.proxy.filepath = bpy.path.relpath(fileoutput)
-        if (proxysuffix == "25"):
-            strip.proxy.build_25 = True
-        if (proxysuffix == "50"):
-            strip.proxy.build_50 = True
-        if (proxysuffix == "75"):
-            strip.proxy.build_75 = True
-        if (proxysuffix == "100"):
-            strip.proxy.build_100 = True
+    def priority(job):
+        strips = [sequences.get(name) for name in job.strip_names]
+        return min([strip_priority(strip) for strip in strips
+            if strip is not None] or [(2, 0)])
+    return priority
 
-    if scripts:
-        return commands
-    else:
-        return None
+
+# running proxy jobs, used by the panel to show progress
+active_scheduler = None
+# copy of the blend file read by the blender internal proxy workers
+worker_copy_path = None
 
 
-def create_proxy_scripts(scripts_dir, commands, strip_name = None):
+def stop_proxy_jobs():
+    '''
+    kills the running proxy jobs, drops the queued ones and lets the
+    proxy operators run again
+    '''
+    global active_scheduler, worker_copy_path
 
-    functions.create_folder(bpy.path.abspath(scripts_dir))
+    if active_scheduler is not None:
+        active_scheduler.cancel()
+        active_scheduler = None
+    if worker_copy_path is not None:
+        try:
+            os.remove(worker_copy_path)
+        except OSError:
+            pass
+        worker_copy_path = None
 
-    for i in commands:
-        #print(i)
-        filename = "{}/proxy_script_{}.sh".format(scripts_dir, strip_name)
-        text_file = open(bpy.path.abspath(filename), "w")
-        #print(filename)
-        text_file.write(i)
-        text_file.close()
 
+@persistent
+def proxy_jobs_load_handler(dummy):
+    # the modal operators polling the jobs do not survive a file load
+    stop_proxy_jobs()
 
 
 # classes
@@ -138,50 +604,170 @@ class CreateProxyOperator(bpy.types.Operator):
     default=1)
     bl_options = {'REGISTER', 'UNDO'}
 
+    _timer = None
+
     @classmethod
     def poll(self, context):
         strip = functions.act_strip(context)
         scn = context.scene
+        if active_scheduler is not None:
+            return False
         if scn and scn.sequence_editor and scn.sequence_editor.active_strip:
             return strip.type in ('MOVIE')
         else:
             return False
 
     def execute(self, context):
+        global active_scheduler
 
         preferences = context.user_preferences
-        proxy_dir = preferences.addons[__package__].preferences.proxy_dir
-        scripts = preferences.addons[__package__].preferences.proxy_scripts
-        proxy_scripts_path = preferences.addons[__package__].preferences.proxy_scripts_path
-        for strip in context.selected_editable_sequences:
-
-            # get resolution from active strip
-            bpy.ops.sequencerextra.read_exif()
-            sce = context.scene
+        prefs = preferences.addons[__package__].preferences
+        sizes = requested_sizes(prefs, self.size)
+        if not sizes:
+            self.report({'WARNING'}, "no proxy size checked")
+            return {'CANCELLED'}
+
+        strips = [strip for strip in context.selected_editable_sequences
+            if strip.type == "MOVIE"]
+        cache = get_proxy_cache(prefs)
+        if cache is not None:
+            # proxies in use are not evicted while this run adds new ones
+            cache.begin_run(attached_cache_keys(cache))
+        # sizes are the same for every strip of a run and the plan
+        # only depends on the source, so one plan and one set of jobs
+        # is built per source file
+        groups = source_groups(strips)
+        sources = [group[0] for group in groups]
+        jobs = []
+        for group, plan, res in zip(groups, strip_plans(context, sources),
+            strip_resolutions(context, sources)):
+            jobs.extend(create_proxy(context, group, sizes, res, plan))
+
+        if prefs.proxy_scripts:
+            if jobs:
+                path = create_proxy_scripts(prefs.proxy_scripts_path, jobs)
+                self.report({'INFO'}, "{} jobs written, run: python3 {} "
+                    "{}".format(len(jobs), os.path.join(os.path.dirname(
+                    __file__), "proxy_runner.py"), path))
+            return {'FINISHED'}
+
+        if not jobs:
+            bpy.ops.sequencer.reload()
+            return {'FINISHED'}
+
+        max_jobs = prefs.proxy_max_jobs or \
+            proxy_jobs.default_max_jobs(prefs.proxy_job_threads)
+        active_scheduler = proxy_jobs.JobScheduler(max_jobs)
+        for job in jobs:
+            active_scheduler.add(job)
+        self.scheduler = active_scheduler
+        self.attach_size = attached_size(sizes)
+        self.scene_name = context.scene.name
+        self.queue_position = None
+        self.reprioritize(context)
+
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.5, context.window)
+        wm.modal_handler_add(self)
+        wm.progress_begin(0, 100)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        scheduler = self.scheduler
+        if scheduler is not active_scheduler:
+            # cancelled
+            return self.finish(context)
+        scene = bpy.data.scenes.get(self.scene_name)
+        prefs = context.user_preferences.addons[__package__].preferences
+        self.reprioritize(context)
+        done = scheduler.poll()
+        if done and prefs.proxy_log_file:
             try:
-                res = sce['metadata'][0]['Composite:ImageSize'].split("x")
-            except:
-                res=(sce.render.resolution_x, sce.render.resolution_y)
-                #print(res)
-
-            commands = create_proxy(context, strip, self.size, res)
+                proxy_jobs.write_log(bpy.path.abspath(prefs.proxy_log_file),
+                    done)
+            except (IOError, OSError) as e:
+                print("cannot write proxy log:", e)
+        for job in done:
+            if job.status != 'DONE':
+                self.report({'WARNING'}, "proxy failed: "+job.command)
+                for line in job.stderr_tail:
+                    print(line)
+                continue
+            cache = get_proxy_cache(prefs)
+            if cache is not None:
+                for key in job.cache_keys:
+                    if key is not None:
+                        cache.add(key, job.source)
+            for name in job.strip_names:
+                try:
+                    strip = scene.sequence_editor.sequences_all[name]
+                except (AttributeError, KeyError):
+                    continue
+                for size, fileoutput in zip(job.sizes, job.outputs):
+                    if size == self.attach_size:
+                        attach_proxy(strip, size, fileoutput)
+
+        context.window_manager.progress_update(int(scheduler.progress()*100))
+        for area in context.screen.areas:
+            if area.type == 'SEQUENCE_EDITOR':
+                area.tag_redraw()
+
+        if scheduler.is_done:
+            return self.finish(context)
+        return {'PASS_THROUGH'}
+
+    def reprioritize(self, context):
+        # build first the proxies the editor is about to watch,
+        # the queue is sorted again when the playhead or the view move
+        scene = bpy.data.scenes.get(self.scene_name)
+        if scene is None or scene.sequence_editor is None:
+            return
+        frame = scene.frame_current
+        view = sequencer_view_range(context)
+        if (frame, view) == self.queue_position:
+            return
+        self.queue_position = (frame, view)
+        self.scheduler.reprioritize(job_priority(
+            scene.sequence_editor.sequences_all, frame, view))
+
+    def finish(self, context):
+        global active_scheduler
+
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        failed = self.scheduler.count('FAILED')
+        if active_scheduler is self.scheduler:
+            active_scheduler = None
+        if failed:
+            self.report({'WARNING'}, "{} proxy jobs failed".format(failed))
+        bpy.ops.sequencer.reload()
+        return {'FINISHED'}
 
-            if commands == None:
-                # Update scene
-                context.scene.update()
-                newstrip = context.scene.sequence_editor.active_strip
+    def cancel(self, context):
+        # blender dropped the modal handler
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        if active_scheduler is self.scheduler:
+            stop_proxy_jobs()
 
-                # deselect all other strips
-                for i in context.selected_editable_sequences:
-                    if i.name != newstrip.name:
-                        i.select=False
 
-                # Update scene
-                context.scene.update()
-            else:
-                create_proxy_scripts(proxy_scripts_path, commands, strip.name)
+class CancelProxyJobsOperator(bpy.types.Operator):
+    """ Stop running proxy jobs and discard the queued ones"""
+    bl_idname = "sequencer.cancel_proxy_jobs"
+    bl_label = "Cancel proxy jobs"
 
+    @classmethod
+    def poll(self, context):
+        return active_scheduler is not None
 
+    def execute(self, context):
+        # the modal operator finishes on its next timer event
+        stop_proxy_jobs()
         return {'FINISHED'}
 
 
@@ -195,36 +781,124 @@ class CreateBIProxyOperator(bpy.types.Operator):
     default=1)
     bl_options = {'REGISTER', 'UNDO'}
 
+    _timer = None
+
     @classmethod
     def poll(self, context):
         strip = functions.act_strip(context)
         scn = context.scene
+        if active_scheduler is not None:
+            return False
         if scn and scn.sequence_editor and scn.sequence_editor.active_strip:
             return strip.type in ('MOVIE')
         else:
             return False
 
     def execute(self, context):
+        global active_scheduler, worker_copy_path
 
         preferences = context.user_preferences
-        strips = functions.get_selected_strips(context)
+        prefs = preferences.addons[__package__].preferences
+        strips = [strip for strip in functions.get_selected_strips(context)
+            if strip.type == "MOVIE"]
 
         for strip in strips:
-            #deselect all other strips 
-            for i in strips: i.select = False
-            #select current strip
-            strip.select = True
-            if strip.type == "MOVIE":
-                setup_proxy(context, strip, self.size)
-        #select all strips again
-        for strip in strips:
-            try: 
-                strip.select=True
-            except ReferenceError:
-                pass
-        bpy.ops.sequencer.reload()
+            setup_proxy(context, strip, self.size)
+
+        if prefs.bi_proxy_workers == 0 or self.size == 5 or not strips:
+            bpy.ops.sequencer.reload()
+            return {'FINISHED'}
+
+        # build in background blender processes working on a copy of
+        # the blend file, saved next to it so relative paths still work
+        if not bpy.data.filepath:
+            self.report({'ERROR'}, "save the blend file first")
+            return {'CANCELLED'}
+        directory, name = os.path.split(bpy.data.filepath)
+        self.copy_path = os.path.join(directory, "." + name + ".proxy_worker.blend")
+        bpy.ops.wm.save_as_mainfile(filepath=self.copy_path, copy=True)
+        worker_copy_path = self.copy_path
+
+        worker = os.path.join(os.path.dirname(__file__), "bi_proxy_worker.py")
+        # proxies and indices are stored per source file, so the files
+        # are split between the workers, one strip of every file
+        sources = [group[0] for group in source_groups(strips)]
+        workers = min(prefs.bi_proxy_workers, len(sources))
+        active_scheduler = proxy_jobs.JobScheduler(workers)
+        self.scheduler = active_scheduler
+        for i in range(workers):
+            names = [strip.name for strip in sources[i::workers]]
+            command = "{} -b {} --python {} -- {} {}".format(
+                shlex.quote(bpy.app.binary_path), shlex.quote(self.copy_path),
+                shlex.quote(worker), shlex.quote(context.scene.name),
+                " ".join(shlex.quote(n) for n in names))
+            print(command)
+            active_scheduler.add(proxy_jobs.ProxyJob(command, [],
+                strip_names=names, total_frames=sum(strip.frame_duration
+                for strip in sources[i::workers])))
+
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.5, context.window)
+        wm.modal_handler_add(self)
+        wm.progress_begin(0, 100)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        scheduler = self.scheduler
+        if scheduler is not active_scheduler:
+            # cancelled
+            return self.finish(context)
+        prefs = context.user_preferences.addons[__package__].preferences
+        done = scheduler.poll()
+        if done and prefs.proxy_log_file:
+            try:
+                proxy_jobs.write_log(bpy.path.abspath(prefs.proxy_log_file),
+                    done)
+            except (IOError, OSError) as e:
+                print("cannot write proxy log:", e)
+        for job in done:
+            if job.status != 'DONE':
+                self.report({'WARNING'}, "proxy worker failed: "+job.command)
+                for line in job.stderr_tail:
+                    print(line)
+
+        context.window_manager.progress_update(int(scheduler.progress()*100))
+        if scheduler.is_done:
+            return self.finish(context)
+        return {'PASS_THROUGH'}
+
+    def finish(self, context):
+        global active_scheduler, worker_copy_path
+
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        failed = self.scheduler.count('FAILED')
+        if active_scheduler is self.scheduler:
+            active_scheduler = None
+        try:
+            os.remove(self.copy_path)
+        except OSError:
+            pass
+        if worker_copy_path == self.copy_path:
+            worker_copy_path = None
+        if failed:
+            self.report({'WARNING'}, "{} proxy workers failed".format(failed))
+        # open the new proxies and indices
+        bpy.ops.sequencer.refresh_all()
         return {'FINISHED'}
 
+    def cancel(self, context):
+        # blender dropped the modal handler
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        if active_scheduler is self.scheduler:
+            stop_proxy_jobs()
+
 
 class CreateProxyToolPanel(bpy.types.Panel):
     """  """
@@ -295,6 +969,15 @@ class CreateProxyToolPanel(bpy.types.Panel):
             layout.operator("sequencer.create_bi_proxy_operator", 
                 text="Clear proxy sizes").size=5
 
+            layout = self.layout
+            layout.prop(prefs, "bi_proxy_workers", text="background workers")
+            if active_scheduler is not None:
+                box = layout.box()
+                box.label("proxy workers: {} running, {}/{} finished".format(
+                    len(active_scheduler.running),
+                    len(active_scheduler.finished), active_scheduler.total))
+                box.operator("sequencer.cancel_proxy_jobs", icon="CANCEL")
+
         else:
 
             layout = self.layout
@@ -315,12 +998,71 @@ class CreateProxyToolPanel(bpy.types.Panel):
                 proxysuffix = proxy_qualities[i][1]
                 row.operator("sequencer.create_proxy_operator",text=proxysuffix).size=i+1
 
+            layout = self.layout
+            row = layout.row(align=True)
+            row.prop(prefs, "proxy_build_25", text="25%", toggle=True)
+            row.prop(prefs, "proxy_build_50", text="50%", toggle=True)
+            row.prop(prefs, "proxy_build_75", text="75%", toggle=True)
+            row.prop(prefs, "proxy_build_100", text="100%", toggle=True)
+            row.operator("sequencer.create_proxy_operator",
+                text="build checked").size=0
+
+            layout = self.layout
+            row = layout.row(align=True)
+            row.prop(prefs, "use_proxy_cache")
+            if prefs.use_proxy_cache:
+                row.prop(prefs, "proxy_cache_size", text="GB")
+                layout.prop(prefs, "proxy_cache_dir", text="cache")
+
+            layout = self.layout
+            layout.prop(prefs, "proxy_single_decode")
+            if prefs.proxy_single_decode:
+                layout.prop(prefs, "ffmpeg_output_args", text="output args")
+
+            layout = self.layout
+            row = layout.row(align=True)
+            row.prop(prefs, "proxy_max_jobs", text="jobs")
+            row.prop(prefs, "proxy_job_threads", text="threads per job")
+            row = layout.row(align=True)
+            row.prop(prefs, "proxy_used_range")
+            if prefs.proxy_used_range:
+                row.prop(prefs, "proxy_handles", text="handles")
+            else:
+                row.prop(prefs, "proxy_segments", text="segments")
+                if prefs.proxy_segments > 1:
+                    row.prop(prefs, "proxy_segment_min_length",
+                        text="from (s)")
+
+            if active_scheduler is not None:
+                box = layout.box()
+                box.label("proxy jobs: {} running, {} queued, {}/{} finished".format(
+                    len(active_scheduler.running), len(active_scheduler.queued),
+                    len(active_scheduler.finished), active_scheduler.total))
+                for job in active_scheduler.running:
+                    remaining = job.remaining()
+                    box.label("{} {}: frame {}/{} {:.1f} fps{}".format(
+                        ", ".join(job.strip_names),
+                        "/".join(proxy_qualities[i-1][1] for i in job.sizes),
+                        job.frames, job.total_frames,
+                        job.fps, "" if remaining is None else
+                        ", {:.0f}s left".format(remaining)))
+                failed = [j for j in active_scheduler.finished
+                    if j.status == 'FAILED']
+                if failed:
+                    box.label("{} failed, last: {}".format(len(failed),
+                        failed[-1].stderr_tail[-1] if failed[-1].stderr_tail
+                        else ", ".join(failed[-1].strip_names)), icon="ERROR")
+                box.operator("sequencer.cancel_proxy_jobs", icon="CANCEL")
+
+            layout = self.layout
+            layout.prop(prefs, "proxy_log_file", text="log")
+
             layout = self.layout
             layout.prop(prefs, "proxy_scripts")
 
             if prefs.proxy_scripts:
                 layout = self.layout
-                layout.prop(prefs, "proxy_scripts_path", text="path for scripts")
+                layout.prop(prefs, "proxy_scripts_path", text="path for jobs.json")
 
         layout = self.layout
         box = layout.box()
@@ -329,5 +1071,8 @@ class CreateProxyToolPanel(bpy.types.Panel):
                 text="Rebuild Proxies and TC")
 
 
-
-    
+# do not stack handlers when the addon is reloaded
+for i in list(bpy.app.handlers.load_post):
+    if getattr(i, "__name__", "") == proxy_jobs_load_handler.__name__:
+        bpy.app.handlers.load_post.remove(i)
+bpy.app.handlers.load_post.append(proxy_jobs_load_handler)
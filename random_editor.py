@@ -79,10 +79,6 @@ class RandomScratchOperator(bpy.types.Operator):
                         a = bpy.ops.sequencer.duplicate_move()
                         # select new strip
                         newstrip = seq.active_strip
-                        # deselect all other strips
-                        for j in context.selected_editable_sequences:
-                            if j.name != newstrip.name:
-                                j.select=False
                         # random cut
                         newstrip.frame_start = sin + i * random_frames
                         rand = functions.randomframe(newstrip)
@@ -158,10 +154,6 @@ class LoadRandomEditOperator(bpy.types.Operator):
                 a = bpy.ops.sequencer.duplicate_move()
                 # select new strip
                 newstrip = seq.active_strip
-                # deselect all other strips
-                for j in bpy.context.selected_editable_sequences:
-                    if j.name != newstrip.name:
-                        j.select=False
                 # random cut
                 #newstrip.frame_start = sin + i * random_frames
                 #rand = functions.randomframe(newstrip)
@@ -20,7 +20,7 @@ import bpy
 
 import random
 import math
-import os, sys
+import os, sys, time
 
 from bpy.props import IntProperty
 from bpy.props import FloatProperty
@@ -28,8 +28,10 @@ from bpy.props import EnumProperty
 from bpy.props import BoolProperty
 from bpy.props import StringProperty
 
+from bpy.app.handlers import persistent
+
 from . import functions
-from . import exiftool
+from . import metadata
 
 
 class Sequencer_Extra_RecursiveLoader(bpy.types.Operator):
@@ -52,6 +54,11 @@ class Sequencer_Extra_RecursiveLoader(bpy.types.Operator):
         name="extension",
         default="3")
 
+    use_scan_cache = BoolProperty(
+        name='use scan cache',
+        description='Do not list again folders not modified since last load',
+        default=True)
+
     
     @classmethod
     def poll(self, context):
@@ -63,31 +70,79 @@ class Sequencer_Extra_RecursiveLoader(bpy.types.Operator):
         
     def invoke(self, context, event):
         scn = context.scene
-        try:
-            self.recursive = scn.kr_recursive
-            self.recursive_select_by_extension = scn.kr_recursive_select_by_extension
-            self.ext = scn.kr_default_ext 
-        except AttributeError:
-            functions.initSceneProperties(context)
-            self.recursive = scn.kr_recursive
-            self.recursive_select_by_extension = scn.kr_recursive_select_by_extension
-            self.ext = scn.kr_default_ext 
+        functions.initSceneProperties(context)
+        self.recursive = scn.kr_recursive
+        self.recursive_select_by_extension = scn.kr_recursive_select_by_extension
+        self.ext = scn.kr_default_ext 
                 
         return context.window_manager.invoke_props_dialog(self)  
         
+    @staticmethod
+    def free_channel(seq, frame):
+        '''
+        returns the lowest channel with no strips after frame that also
+        has a free channel above for the sound of the movies
+        '''
+        used = set()
+        for i in seq.sequences:
+            if i.frame_final_end > frame:
+                used.add(i.channel)
+        channel = 1
+        while channel in used or channel + 1 in used:
+            channel += 1
+        return channel
+
     def loader(self, context, filelist):
+        # all the strips are created through the data api in a single
+        # pass, so loading many files costs one undo step and one reload.
+        # blender reads every file on the main thread to create its
+        # strip, the next strip starts where the new one ends
         scn = context.scene
-        if filelist:
-            for i in filelist:
-                functions.setpathinbrowser(context, i[0], i[1])
-                try:
-                    bpy.ops.sequencerextra.placefromfilebrowser()
-                except:
-                    print("Error loading file (recursive loader error): ", i[1])
-                    functions.add_marker(context, i[1], scn.frame_current)
-                    self.report({'ERROR_INVALID_INPUT'}, 'Error loading file ')
-                    pass
+        seq = scn.sequence_editor
+        if not filelist:
+            return
+
+        start_time = time.time()
+        frame = scn.frame_current
+        channel = self.free_channel(seq, frame)
+
+        newstrips = []
+        for i in filelist:
+            file_time = time.time()
+            name = i[1]
+            filepath = os.path.join(i[0], i[1])
+            try:
+                strip = seq.sequences.new_movie(name=name,
+                    filepath=filepath, channel=channel, frame_start=frame)
+            except RuntimeError:
+                print("Error loading file (recursive loader error): ", name)
+                functions.add_marker(context, name, frame)
+                self.report({'ERROR_INVALID_INPUT'}, 'Error loading file ')
+                continue
+            newstrips.append(strip)
+            try:
+                sound = seq.sequences.new_sound(name=name,
+                    filepath=filepath, channel=channel + 1, frame_start=frame)
+                sound.frame_final_duration = strip.frame_final_duration
+                newstrips.append(sound)
+            except RuntimeError:
+                # movie without audio
+                pass
+            frame += strip.frame_final_duration
+            print("loaded {} in {:.3f}s".format(name, time.time() - file_time))
 
+        for i in seq.sequences:
+            i.select = False
+        for i in newstrips:
+            i.select = True
+        if newstrips:
+            seq.active_strip = newstrips[0]
+        scn.frame_current = frame
+        bpy.ops.sequencer.reload()
+
+        self.report({'INFO'}, "loaded {} files in {:.2f}s".format(
+            len([i for i in newstrips if i.type == 'MOVIE']),
+            time.time() - start_time))
 
     def execute(self, context):
         scn = context.scene
@@ -95,27 +150,50 @@ class Sequencer_Extra_RecursiveLoader(bpy.types.Operator):
             #recursive
             self.loader(context, functions.sortlist(\
             functions.recursive(context, self.recursive_select_by_extension,\
-            self.ext)))
+            self.ext, self.use_scan_cache)))
         else:
             #non recursive
             self.loader(context, functions.sortlist(functions.onefolder(\
-            context, self.recursive_select_by_extension, self.ext)))
-        try:   
-            scn.kr_recursive = self.recursive 
-            scn.kr_recursive_select_by_extension = self.recursive_select_by_extension 
-            scn.kr_default_ext = self.ext 
-        except AttributeError:
-            functions.initSceneProperties(context)
-            self.recursive = scn.kr_recursive
-            self.recursive_select_by_extension = scn.kr_recursive_select_by_extension
-            self.ext = scn.kr_default_ext
+            context, self.recursive_select_by_extension, self.ext,\
+            self.use_scan_cache)))
+        scn.kr_recursive = self.recursive 
+        scn.kr_recursive_select_by_extension = self.recursive_select_by_extension 
+        scn.kr_default_ext = self.ext 
             
         return {'FINISHED'}
 
 
 # READ EXIF DATA
+
+def strip_files(strip):
+    '''
+    returns the list of files shown by an IMAGE or MOVIE strip, one per
+    frame for image sequences. Paths are absolute, since exiftool
+    processes are shared and keep their own working directory
+    '''
+    if strip.type == "IMAGE":
+        path = bpy.path.abspath(strip.directory)
+        return [os.path.join(path, i.filename) for i in strip.elements]
+    if strip.type == "MOVIE":
+        return [bpy.path.abspath(strip.filepath)]
+    return []
+
+
+def strip_frame_store(strip):
+    '''
+    returns the lazy metadata store for the strip files
+    '''
+    if strip.type == "IMAGE":
+        key = (strip.name, strip.directory, len(strip.elements))
+    else:
+        key = (strip.name, strip.filepath, 1)
+    return metadata.get_frame_store(key, lambda: strip_files(strip),
+        strip.frame_start)
+
+
 class Sequencer_Extra_ReadExifData(bpy.types.Operator):
-    # load exifdata from strip to scene['metadata'] property
+    # show exifdata from strip in the exif panel, only a reference to
+    # the strip is stored in the scene['metadata_strip'] property
     bl_label = 'Read EXIF Data'
     bl_idname = 'sequencerextra.read_exif'
     bl_description = 'Load exifdata from strip to metadata property in scene'
@@ -131,74 +209,56 @@ class Sequencer_Extra_ReadExifData(bpy.types.Operator):
 
 
     def execute(self, context):
-        try:
-            exiftool.ExifTool().start()
-        except:
+        if not metadata.check_exiftool():
             self.report({'ERROR_INVALID_INPUT'},
             'exiftool not found in PATH')
             return {'CANCELLED'}
 
-        def getexifdata(strip):
-
-            def getexifvalues_image(lista):
-                metadata = []
-                with exiftool.ExifTool() as et:
-                    try:
-                        metadata = et.get_metadata_batch(lista)
-                    except UnicodeDecodeError as Err:
-                        print(Err)
-                #print(metadata[0])
-                print(len(metadata))
-                return metadata
-
-            def getexifvalues_movie(path):
-                metadata = []
-                with exiftool.ExifTool() as et:
-                    try:
-                        metadata = et.get_metadata_batch([path])
-                    except UnicodeDecodeError as Err:
-                        print(Err)
-                print(metadata[0])
-                print(len(metadata))
-                return metadata
-
-            def getlist(lista):
-                for root, dirs, files in os.walk(path):
-                    for f in files:
-                        if "." + f.rpartition(".")[2].lower() \
-                            in functions.imb_ext_image:
-                            lista.append(f)
-                        #if "."+f.rpartition(".")[2] in imb_ext_movie:
-                        #    lista.append(f)
-                strip.elements
-                lista.sort()
-                return lista
-
-            if strip.type == "IMAGE":
-                path = bpy.path.abspath(strip.directory)
-                os.chdir(path)
-                #get a list of files
-                lista = []
-                for i in strip.elements:
-                    lista.append(i.filename)
-                print(lista)
-                return getexifvalues_image(lista)
-
-            if strip.type == "MOVIE":
-                path = bpy.path.abspath(strip.filepath)
-                print([path])
-                return getexifvalues_movie(path)
-            
-            
-
-        sce = bpy.context.scene
-        frame = sce.frame_current
-        text = bpy.context.active_object
+        sce = context.scene
         strip = context.scene.sequence_editor.active_strip
-        sce['metadata'] = getexifdata(strip)
+
+        # metadata is read lazily around the current frame and kept
+        # out of the blend file
+        store = strip_frame_store(strip)
+        index = 0
+        if len(store) > 1:
+            index = sce.frame_current - strip.frame_start
+        store.get(index)
+        store.prefetch(index)
+
+        if 'metadata' in sce:
+            # drop data stored by older versions
+            del sce['metadata']
+        sce['metadata_strip'] = strip.name
         return {'FINISHED'}
 
 
+@persistent
+def exif_prefetch_handler(scn):
+    # read ahead the metadata of the next frames while playing
+    store = metadata.current_frame_store()
+    if store is None or len(store) < 2:
+        return
+    screen = bpy.context.screen
+    if screen and screen.is_animation_playing:
+        store.prefetch(scn.frame_current - store.frame_start)
+
+
+@persistent
+def exif_redraw_handler(scn):
+    # show the metadata read in background by the frame store
+    store = metadata.current_frame_store()
+    if store is None or not store.updated:
+        return
+    store.updated = False
+    screen = bpy.context.screen
+    if screen is None:
+        return
+    for area in screen.areas:
+        if area.type == 'SEQUENCE_EDITOR':
+            area.tag_redraw()
+
+
 class ExifInfoPanel(bpy.types.Panel):
     """Creates a Panel in the Object properties window"""
     """ TODO: fix poll to hide when unuseful"""
@@ -235,27 +295,43 @@ class ExifInfoPanel(bpy.types.Panel):
 
         try:
             strip = context.scene.sequence_editor.active_strip
+            if sce.get('metadata_strip') != strip.name:
+                return
 
             f = strip.frame_start
             frame = sce.frame_current
-            try:
-                if len(sce['metadata']) == 1:
-                    for d in sce['metadata'][0]:
-                        split = layout.split(percentage=0.5)
-                        col = split.column()
-                        row = col.row()
-                        col.label(text=d)
-                        col = split.column()
-                        col.label(str(sce['metadata'][0][d]))
-                else:
-                    for d in sce['metadata'][frame - f]:
-                        split = layout.split(percentage=0.5)
-                        col = split.column()
-                        row = col.row()
-                        col.label(text=d)
-                        col = split.column()
-                        col.label(str(sce['metadata'][frame - f][d]))
-            except (IndexError, KeyError):
-                pass
+            store = strip_frame_store(strip)
+            if len(store) == 1:
+                index = 0
+            else:
+                index = frame - f
+            if not 0 <= index < len(store):
+                return
+            data = store.peek(index)
+            if data is None:
+                # never wait for exiftool while drawing, the panel is
+                # drawn again by exif_redraw_handler
+                store.prefetch(index)
+                layout.label(text="reading...")
+                return
+            if not data:
+                return
+            for d in data:
+                split = layout.split(percentage=0.5)
+                col = split.column()
+                row = col.row()
+                col.label(text=d)
+                col = split.column()
+                col.label(str(data[d]))
         except AttributeError:
-            pass
\ No newline at end of file
+            pass
+
+
+# do not stack handlers when the addon is reloaded
+exif_handlers = ((bpy.app.handlers.frame_change_post, exif_prefetch_handler),
+    (bpy.app.handlers.scene_update_post, exif_redraw_handler))
+for handlers, handler in exif_handlers:
+    for i in list(handlers):
+        if getattr(i, "__name__", "") == handler.__name__:
+            handlers.remove(i)
+    handlers.append(handler)
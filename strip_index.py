@@ -0,0 +1,216 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# timeline queries on a set of strips.
+# the index is built once per operator call from the strip positions
+# (sorted start and end arrays, sorted starts per channel and a
+# centered interval tree), then every query is a bisection instead of
+# a scan of all the sequences. It does not import bpy, any object with
+# frame_final_start, frame_final_end, channel and mute works, and it
+# does not follow changes made to the strips after it is built.
+# ripple_gaps() and ripple_offsets() compute the moves of a ripple
+# delete of many strips at once, so every strip is moved only once.
+
+from bisect import bisect_left, bisect_right
+
+
+class IntervalNode(object):
+    '''
+    node of a centered interval tree, keeps the intervals containing
+    center sorted by start and by end
+    '''
+
+    def __init__(self, intervals):
+        # intervals are (start, end, item) with end exclusive
+        points = sorted(i[0] for i in intervals)
+        self.center = points[len(points) // 2]
+        left = []
+        right = []
+        here = []
+        for i in intervals:
+            if i[1] <= self.center:
+                left.append(i)
+            elif i[0] > self.center:
+                right.append(i)
+            else:
+                here.append(i)
+        self.by_start = sorted(here, key=lambda i: i[0])
+        self.by_end = sorted(here, key=lambda i: i[1], reverse=True)
+        self.left = IntervalNode(left) if left else None
+        self.right = IntervalNode(right) if right else None
+
+    def query(self, frame, result):
+        node = self
+        while node is not None:
+            if frame < node.center:
+                for i in node.by_start:
+                    if i[0] > frame:
+                        break
+                    result.append(i[2])
+                node = node.left
+            else:
+                for i in node.by_end:
+                    if i[1] <= frame:
+                        break
+                    result.append(i[2])
+                node = node.right
+        return result
+
+
+class StripIndex(object):
+    '''
+    sorted views of the strips for timeline queries.
+    skip_muted leaves muted strips out of the index
+    '''
+
+    def __init__(self, strips, skip_muted=False):
+        intervals = []
+        channels = {}
+        for strip in strips:
+            try:
+                if skip_muted and strip.mute:
+                    continue
+                interval = (strip.frame_final_start, strip.frame_final_end,
+                    strip)
+                channel = strip.channel
+            except AttributeError:
+                continue
+            intervals.append(interval)
+            channels.setdefault(channel, []).append(interval)
+
+        by_start = sorted(intervals, key=lambda i: i[0])
+        self.starts = [i[0] for i in by_start]
+        self.strips_by_start = [i[2] for i in by_start]
+
+        by_end = sorted(intervals, key=lambda i: i[1])
+        self.ends = [i[1] for i in by_end]
+        self.strips_by_end = [i[2] for i in by_end]
+
+        self.channels = {}
+        for channel, items in channels.items():
+            items.sort(key=lambda i: i[0])
+            self.channels[channel] = ([i[0] for i in items],
+                [i[2] for i in items])
+
+        self.tree = IntervalNode(intervals) if intervals else None
+
+    def __len__(self):
+        return len(self.starts)
+
+    def bounds(self):
+        '''
+        returns (first start, last end) of the strips, or None if empty
+        '''
+        if not self.starts:
+            return None
+        return self.starts[0], self.ends[-1]
+
+    def next_edit_after(self, frame):
+        '''
+        returns the first strip start after frame, or None
+        '''
+        i = bisect_right(self.starts, frame)
+        if i == len(self.starts):
+            return None
+        return self.starts[i]
+
+    def starting_from(self, frame):
+        '''
+        returns the strips starting at frame or later
+        '''
+        return self.strips_by_start[bisect_left(self.starts, frame):]
+
+    def starting_after(self, frame):
+        '''
+        returns the strips starting after frame
+        '''
+        return self.strips_by_start[bisect_right(self.starts, frame):]
+
+    def ending_before(self, frame):
+        '''
+        returns the strips ending before frame
+        '''
+        return self.strips_by_end[:bisect_left(self.ends, frame)]
+
+    def covering(self, frame):
+        '''
+        returns the strips shown at frame
+        '''
+        if self.tree is None:
+            return []
+        return self.tree.query(frame, [])
+
+    def channel_next_start(self, channel, frame):
+        '''
+        returns the first strip start after frame on channel, or None
+        '''
+        if channel not in self.channels:
+            return None
+        starts = self.channels[channel][0]
+        i = bisect_right(starts, frame)
+        if i == len(starts):
+            return None
+        return starts[i]
+
+    def channel_starting_from(self, channel, frame):
+        '''
+        returns the strips of channel starting at frame or later
+        '''
+        if channel not in self.channels:
+            return []
+        starts, strips = self.channels[channel]
+        return strips[bisect_left(starts, frame):]
+
+    def ripple_gaps(self, cuts):
+        '''
+        returns the merged (start, end) gaps left by strips removed at
+        the cut frames: every gap runs from the cut to the next strip
+        start of the index. Cuts with no strip after them leave no gap
+        '''
+        gaps = []
+        for cut in cuts:
+            next_edit = self.next_edit_after(cut)
+            if next_edit is not None:
+                gaps.append((cut, next_edit))
+        gaps.sort()
+        merged = []
+        for start, end in gaps:
+            if merged and start < merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+            else:
+                merged.append((start, end))
+        return merged
+
+    def ripple_offsets(self, gaps):
+        '''
+        returns (strip, offset) for every strip after the gaps, in start
+        order, offset being the length of all the gaps before the strip
+        '''
+        if not gaps:
+            return []
+        result = []
+        offset = 0
+        gap = 0
+        first = bisect_left(self.starts, gaps[0][1])
+        for start, strip in zip(self.starts[first:],
+            self.strips_by_start[first:]):
+            while gap < len(gaps) and gaps[gap][1] <= start:
+                offset += gaps[gap][1] - gaps[gap][0]
+                gap += 1
+            result.append((strip, offset))
+        return result